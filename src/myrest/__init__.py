@@ -1,3 +1,3 @@
 VERSION = (0, 1, 0)
 name = "myrest"
-__all__ = ['myparser', 'myrestengine']
+__all__ = ['myparser', 'myrestengine', 'mycache']
@@ -0,0 +1,273 @@
+# -*- coding: UTF-8 -*-
+"""
+Micro benchmarks comparing optimized code paths with the ones they replace.
+
+Run with: python -m myrest.mybenchmark
+"""
+from .myparser import Parser
+import datetime
+import json
+import timeit
+
+
+def generateQuery(conditions):
+    """Build a machine generated like filter with given number of conditions"""
+    parts = []
+    for i in range(conditions):
+        if i % 3 == 0:
+            parts.append('(name%d="value %d"|code%d!=None)' % (i, i, i))
+        else:
+            parts.append("field_%d>='%d'" % (i, i))
+    return ','.join(parts)
+
+
+def benchmarkLexer(conditions=200, number=10):
+    text = generateQuery(conditions)
+    legacy = timeit.timeit(lambda: Parser(text, legacyLexer=True), number=number)
+    current = timeit.timeit(lambda: Parser(text), number=number)
+    return {
+        'name': 'lexer, %d conditions, %d chars' % (conditions, len(text)),
+        'legacy': legacy / number,
+        'current': current / number
+    }
+
+
+def legacyPopulateToJson(jsonDict, djangoModel, fields, reqFields=None):
+    """Row serialization before RowSerializer, mapping interpreted and eval'd for every field of every row"""
+    from django.utils import timezone
+    onlyReturnReqFeilds = reqFields is not None and len(reqFields) > 0
+    for field in fields:
+        if type(field) is tuple:
+            jfield, mfield = field[0], field[1]
+        else:
+            mfield = jfield = field
+        if callable(mfield):
+            value = mfield(djangoModel)
+        elif type(mfield) is dict:
+            value = mfield.get('value', None)
+        else:
+            value = eval('djangoModel.%s' % mfield)
+        if type(value) is datetime.datetime:
+            value = str(timezone.localtime(value).strftime("%Y-%m-%d %H:%M:%S"))
+        if onlyReturnReqFeilds and jfield not in reqFields:
+            continue
+        jsonDict[jfield] = value
+    return jsonDict
+
+
+class BenchmarkRow(object):
+    def __init__(self, i, fields):
+        for f in range(fields):
+            setattr(self, 'field%d' % f, '%d-%d' % (i, f))
+        self.createdAt = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(minutes=i)
+        self.parent = self
+
+
+def createBenchmarkProcessor(fields):
+    from .myrestengine import RESTProcessor
+    mapping = ['field%d' % f for f in range(fields - 4)] + [
+        ('created', 'createdAt'),
+        ('parentField', 'parent.field0'),
+        ('computed', lambda m: m.field0 + m.field1),
+        ('constant', {'value': 1})
+    ]
+
+    class BenchmarkProcessor(RESTProcessor):
+        def getPopulateFieldMapping(self):
+            return mapping
+
+    return BenchmarkProcessor(None), mapping
+
+
+def benchmarkRowSerializer(rows=5000, fields=30, number=3):
+    """Model objects to dicts, mapping interpreted per row against compiled RowSerializer"""
+    from .myrestengine import JsonEncoder
+    processor, mapping = createBenchmarkProcessor(fields)
+    models = [BenchmarkRow(i, fields) for i in range(rows)]
+    if JsonEncoder().encode(processor.convertDataList(models[:10])) != \
+            json.dumps([legacyPopulateToJson({}, m, mapping) for m in models[:10]]).encode('utf-8'):
+        raise AssertionError('RowSerializer result differs from legacy')
+    legacy = timeit.timeit(lambda: [legacyPopulateToJson({}, m, mapping) for m in models], number=number)
+    current = timeit.timeit(lambda: processor.convertDataList(models), number=number)
+    return {
+        'name': 'rows, %d rows x %d fields' % (rows, fields),
+        'legacy': legacy / number,
+        'current': current / number,
+        'perRow': True,
+        'rows': rows
+    }
+
+
+def benchmarkJsonEncoder(rows=5000, fields=30, number=3):
+    """Model objects to response bytes, legacy serializer with json.dumps against current with default encoder"""
+    from .myrestengine import createJsonEncoder
+    processor, mapping = createBenchmarkProcessor(fields)
+    models = [BenchmarkRow(i, fields) for i in range(rows)]
+    encoder = createJsonEncoder()
+    legacy = timeit.timeit(lambda: json.dumps([legacyPopulateToJson({}, m, mapping) for m in models]).encode('utf-8'),
+                           number=number)
+    current = timeit.timeit(lambda: encoder.encode(processor.convertDataList(models)), number=number)
+    return {
+        'name': 'json, %d rows x %d fields, %s' % (rows, fields, type(encoder).__name__),
+        'legacy': legacy / number,
+        'current': current / number,
+        'perRow': True,
+        'rows': rows
+    }
+
+
+def benchmarkXmlWriter(rows=5000, fields=30, number=3):
+    """Rows to xml bytes, ElementTree tree with tostring against XmlWriter"""
+    from .myrestengine import XmlConvert, XmlWriter, JsonEncoder
+    from xml.etree.ElementTree import tostring
+    processor, mapping = createBenchmarkProcessor(fields)
+    data = processor.convertDataList([BenchmarkRow(i, fields) for i in range(rows)])
+    formatValue = JsonEncoder().forResponse().formatValue
+    if tostring(XmlConvert.json_to_xml('xml', data[:10], formatValue)) != \
+            XmlWriter(formatValue).tostring('xml', data[:10]):
+        raise AssertionError('XmlWriter result differs from ElementTree')
+    legacy = timeit.timeit(lambda: tostring(XmlConvert.json_to_xml('xml', data, formatValue)), number=number)
+    current = timeit.timeit(lambda: b''.join(XmlWriter(formatValue).iterWrite('xml', data)), number=number)
+    return {
+        'name': 'xml write, %d rows x %d fields' % (rows, fields),
+        'legacy': legacy / number,
+        'current': current / number,
+        'perRow': True,
+        'rows': rows
+    }
+
+
+def benchmarkXmlParser(fields=2000, items=50, number=5):
+    """Request body to dict, fromstring against iterparse"""
+    from .myrestengine import XmlConvert, XmlWriter
+    body = {'field%d' % f: ['value %d' % i for i in range(items)] if f % 2 else 'value %d' % f for f in range(fields)}
+    text = XmlWriter().tostring('xml', body)
+    if XmlConvert.xml_to_dict(text) != XmlConvert.iterparse_to_dict(text):
+        raise AssertionError('iterparse result differs from fromstring')
+    legacy = timeit.timeit(lambda: XmlConvert.xml_to_dict(text), number=number)
+    current = timeit.timeit(lambda: XmlConvert.iterparse_to_dict(text), number=number)
+    return {
+        'name': 'xml parse, %d fields, %d bytes' % (fields, len(text)),
+        'legacy': legacy / number,
+        'current': current / number,
+        # iterparse trades time for memory, peak memory shows what it is for
+        'memory': (peakMemory(XmlConvert.xml_to_dict, text), peakMemory(XmlConvert.iterparse_to_dict, text))
+    }
+
+
+def peakMemory(function, *args):
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmarkValuesList(rows=5000, fields=30, number=3):
+    """List of wide table read as model objects against values_list, in memory sqlite"""
+    from django.db import connection, models
+    from .myrestengine import RESTProcessor
+    attrs = {'field%d' % f: models.CharField(max_length=20) for f in range(fields)}
+    attrs.update({'__module__': __name__, 'Meta': type('Meta', (), {'app_label': 'mybenchmark'})})
+    model = type('BenchmarkWideRow', (models.Model,), attrs)
+    with connection.schema_editor() as editor:
+        editor.create_model(model)
+    model.objects.bulk_create([model(**{'field%d' % f: '%d-%d' % (i, f) for f in range(fields)})
+                               for i in range(rows)])
+    mapping = ['id'] + ['field%d' % f for f in range(fields)]
+
+    class BenchmarkProcessor(RESTProcessor):
+        def getPopulateFieldMapping(self):
+            return mapping
+
+    processor = BenchmarkProcessor(model)
+    queryset = model.objects.order_by('id')
+    legacy = timeit.timeit(lambda: processor.convertDataList(queryset.all()), number=number)
+    current = timeit.timeit(lambda: list(processor.iterConvertQuerySet(queryset.all())), number=number)
+    if processor.convertDataList(queryset.all()) != list(processor.iterConvertQuerySet(queryset.all())):
+        raise AssertionError('values_list result differs from model objects')
+    with connection.schema_editor() as editor:
+        editor.delete_model(model)
+    return {
+        'name': 'values_list, %d rows x %d fields' % (rows, fields + 1),
+        'legacy': legacy / number,
+        'current': current / number,
+        'perRow': True,
+        'rows': rows
+    }
+
+
+def benchmarkCursorPagination(rows=100000, pageSize=25, number=20):
+    """Last page of an ordered list, OFFSET of _page against seek of _cursor, in memory sqlite"""
+    from django.db import connection, models
+    from .myrestengine import RESTProcessor, encodeCursor, decodeCursor
+    attrs = {'name': models.CharField(max_length=20), 'age': models.IntegerField(db_index=True)}
+    attrs.update({'__module__': __name__, 'Meta': type('Meta', (), {'app_label': 'mybenchmark',
+                                                                     'indexes': [models.Index(fields=['age', 'id'])]})})
+    model = type('BenchmarkPagedRow', (models.Model,), attrs)
+    with connection.schema_editor() as editor:
+        editor.create_model(model)
+    model.objects.bulk_create([model(name='row %d' % i, age=i % 100) for i in range(rows)])
+
+    class BenchmarkProcessor(RESTProcessor):
+        def getPopulateFieldMapping(self):
+            return ['id', 'name', 'age']
+
+    processor = BenchmarkProcessor(model)
+    queryset = model.objects.order_by('age', 'id')
+    # Key field id follows _order, as getCursorFields gives for _order=age
+    fields = [('age', False), ('id', False)]
+    cursor = encodeCursor(fields, queryset.values_list('age', 'id')[rows - pageSize - 1])
+    seek = queryset.filter(processor.buildSeekQobject(fields, decodeCursor(cursor, fields)))
+    offsetPage = queryset[rows - pageSize:rows]
+    if list(processor.iterConvertQuerySet(offsetPage)) != processor.getCursorPage(seek, fields, pageSize)[0]:
+        raise AssertionError('cursor page differs from offset page')
+    legacy = timeit.timeit(lambda: list(processor.iterConvertQuerySet(offsetPage.all())), number=number)
+    current = timeit.timeit(lambda: processor.getCursorPage(seek, fields, pageSize), number=number)
+    with connection.schema_editor() as editor:
+        editor.delete_model(model)
+    return {
+        'name': 'last page, %d rows, %d per page' % (rows, pageSize),
+        'legacy': legacy / number,
+        'current': current / number
+    }
+
+
+def printResult(result):
+    print('%-45s legacy %10.3f ms  current %10.3f ms  x%.1f' % (
+        result['name'], result['legacy'] * 1000, result['current'] * 1000,
+        result['legacy'] / result['current'] if result['current'] else 0))
+    if result.get('perRow'):
+        print('%-45s legacy %10.3f us  current %10.3f us' % (
+            '  per row', result['legacy'] * 1e6 / result['rows'], result['current'] * 1e6 / result['rows']))
+    if result.get('memory'):
+        print('%-45s legacy %10d KB  current %10d KB' % (
+            '  peak memory', result['memory'][0] / 1024, result['memory'][1] / 1024))
+
+
+def configureDjango():
+    # Row benchmarks use django timezone and an in memory database, settings are not needed otherwise
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(USE_TZ=True, TIME_ZONE='UTC',
+                           DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}})
+        import django
+        django.setup()
+
+
+def main():
+    for conditions in (10, 100, 500):
+        printResult(benchmarkLexer(conditions))
+    configureDjango()
+    printResult(benchmarkRowSerializer())
+    printResult(benchmarkJsonEncoder())
+    printResult(benchmarkXmlWriter())
+    printResult(benchmarkXmlParser())
+    printResult(benchmarkValuesList())
+    printResult(benchmarkCursorPagination())
+
+
+if __name__ == '__main__':
+    main()
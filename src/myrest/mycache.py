@@ -0,0 +1,145 @@
+# -*- coding: UTF-8 -*-
+from collections import OrderedDict
+import threading, time
+
+
+class LRUCache(object):
+    """Bounded, thread safe least-recently-used cache with hit/miss/eviction statistics"""
+
+    def __init__(self, maxSize=1024):
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__items = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.__lock:
+            try:
+                value = self.__items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.__items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxSize <= 0:
+            return
+        with self.__lock:
+            self.__items[key] = value
+            self.__items.move_to_end(key)
+            while len(self.__items) > self.maxSize:
+                self.__items.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self.__lock:
+            return self.__items.pop(key, default)
+
+    def clear(self):
+        with self.__lock:
+            self.__items.clear()
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __contains__(self, key):
+        return key in self.__items
+
+    def stats(self):
+        return {
+            'size': len(self.__items),
+            'maxSize': self.maxSize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class ResultCache(object):
+    """
+    Read-through cache of list and single results per entity, all entries of an entity are dropped
+    together by moving to next generation of the entity. Keeps nothing itself, results are always loaded
+    """
+
+    def getOrLoad(self, entityName, key, timeout, load):
+        """Cached result of key, otherwise result of load() cached for timeout seconds"""
+        return load()
+
+    def invalidate(self, entityName):
+        pass
+
+
+class LocalResultCache(ResultCache):
+    """Results in LRUCache of the process, pickled so that a request can't change results of others"""
+
+    def __init__(self, maxSize=1024):
+        self.entries = LRUCache(maxSize)
+        self.__generations = {}
+        self.__lock = threading.Lock()
+
+    def getOrLoad(self, entityName, key, timeout, load):
+        # Generation is taken before load, a result read before a write is never kept after it
+        entryKey = (entityName, self.__generations.get(entityName, 0), key)
+        entry = self.entries.get(entryKey)
+        # pickle is only imported when results are cached
+        import pickle
+        if entry is not None and entry[0] > time.time():
+            return pickle.loads(entry[1])
+        result = load()
+        self.entries.put(entryKey, (time.time() + timeout, pickle.dumps(result, pickle.HIGHEST_PROTOCOL)))
+        return result
+
+    def invalidate(self, entityName):
+        with self.__lock:
+            self.__generations[entityName] = self.__generations.get(entityName, 0) + 1
+
+    def stats(self):
+        return self.entries.stats()
+
+
+class DjangoResultCache(ResultCache):
+    """Results in a cache of django cache framework, e.g. memcached or redis shared by all workers"""
+
+    def __init__(self, alias='default', prefix='myrest'):
+        self.alias = alias
+        self.prefix = prefix
+
+    def getCache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def getOrLoad(self, entityName, key, timeout, load):
+        cache = self.getCache()
+        entryKey = '%s:%s:%s:%s' % (self.prefix, entityName, self.__getGeneration(cache, entityName), key)
+        result = cache.get(entryKey, self)
+        if result is not self:
+            return result
+        result = load()
+        cache.set(entryKey, result, timeout)
+        return result
+
+    def invalidate(self, entityName):
+        cache = self.getCache()
+        self.__getGeneration(cache, entityName)
+        try:
+            # incr is atomic in shared backends, concurrent writes each move to a new generation
+            cache.incr(self.__generationKey(entityName))
+        except ValueError:
+            # Evicted meanwhile, next generation is started on next read
+            pass
+
+    def __getGeneration(self, cache, entityName):
+        generationKey = self.__generationKey(entityName)
+        generation = cache.get(generationKey, None)
+        if generation is None:
+            # New or evicted, start after any generation used before so that old entries are not used again
+            cache.add(generationKey, int(time.time() * 1000000), None)
+            generation = cache.get(generationKey, None)
+        return generation
+
+    def __generationKey(self, entityName):
+        return '%s:%s:generation' % (self.prefix, entityName)
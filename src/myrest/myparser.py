@@ -1,4 +1,5 @@
 # -*- coding: UTF-8 -*-
+from .mycache import LRUCache
 import re
 
 
@@ -86,9 +87,55 @@ class StringReader(object):
         return self.currentPosition == -1
 
 
-class Parser(object):
+class Lexer(object):
+    """
+    Single pass tokenizer based on one precompiled pattern, produces the same tokens as
+    Parser.convertToStack with the start position of each token appended
+    """
+    pattern = re.compile(r"""
+        (?P<blank>[ ]+)
+      | (?P<condition>[()|,])
+      | (?P<list>[\[\]])
+      | (?P<operator>!%%|!=|!@|!%|%%|>=|<=|[=@%><])
+      | (?P<string>"[^"]*"|'[^']*')
+      | (?P<variable>[A-Za-z0-9_]+)
+    """, re.VERBOSE)
+
     def __init__(self, text):
         self.text = text
+
+    def tokenize(self):
+        """Return list of (type, text, position) in reading order"""
+        text = self.text
+        match = self.pattern.match
+        tokens = []
+        append = tokens.append
+        position = 0
+        length = len(text)
+        while position < length:
+            m = match(text, position)
+            if not m:
+                if text[position] in '"\'':
+                    raise Exception('Scan error, string not closed at %d' % position)
+                raise Exception('Scan error, char not allow at %d' % position)
+            kind = m.lastgroup
+            if kind != 'blank':
+                append((kind, m.group(), position))
+            position = m.end()
+        return tokens
+
+
+class Parser(object):
+    def __init__(self, text, legacyLexer=False, limits=None):
+        """
+        limits is optional dict of hard limits, rejected before parsing:
+        maxLength(number of chars), maxTerms(number of conditions), maxDepth(nested brackets)
+        """
+        self.text = text
+        self.limits = limits or {}
+        maxLength = self.limits.get('maxLength', None)
+        if maxLength and len(text) > maxLength:
+            raise Exception('Query exceeds max length of %d chars' % maxLength)
         self.textStack = []
         self.parseStack = []
         self.priorityStack = []
@@ -104,6 +151,10 @@ class Parser(object):
                 (1, '\|'),
                 (1, ',')
             ],
+            'list': [
+                (1, '\['),
+                (1, '\]')
+            ],
             'operator': [
                 (1, '='),   # equal
                 (2, '!='),  # not equal
@@ -125,7 +176,33 @@ class Parser(object):
         self.variable_definiation = {
             'variable': [(1, """[A-Za-z0-9_]""")]
         }
-        self.convertToStack()
+        # Operators accept list value, e.g. id=['1','2'] or age@['18','30']
+        self.listOperators = ['=', '!=', '@', '!@']
+        if legacyLexer:
+            self.convertToStack()
+        else:
+            self.textStack = Lexer(text).tokenize()
+            self.textStack.reverse()
+        self.checkLimits()
+
+    def checkLimits(self):
+        maxTerms = self.limits.get('maxTerms', None)
+        maxDepth = self.limits.get('maxDepth', None)
+        if not maxTerms and not maxDepth:
+            return
+        terms = 0
+        depth = 0
+        for node in reversed(self.textStack):
+            if node[0] == 'operator':
+                terms += 1
+                if maxTerms and terms > maxTerms:
+                    self.raiseError('Query exceeds max %d conditions' % maxTerms, node)
+            elif node[0] == 'condition' and node[1] == '(':
+                depth += 1
+                if maxDepth and depth > maxDepth:
+                    self.raiseError('Query exceeds max %d nested brackets' % maxDepth, node)
+            elif node[0] == 'condition' and node[1] == ')':
+                depth -= 1
 
     def checkDefinition(self, table, char):
         # result = None
@@ -172,26 +249,10 @@ class Parser(object):
                 self.raiseError('Scan error, char not allow', (None, self.reader.currentPosition))
 
     def raiseError(self, desc, node):
+        if len(node) > 2:
+            raise Exception('%s at %s, position %d' % (desc, node[1], node[2]))
         raise Exception('%s at %s' % (desc, node[1]))
 
-    def parsePush(self, node, status, parseFunc, parseEndStatus):
-        self.textStack.pop()
-        status.append(node[1])
-        result = parseFunc(status)
-        status[-1] = parseEndStatus
-        return result
-
-    def parsePop(self, node, status, parseEndStatus):
-        previousChar = self.pair.get(node[1], None)
-        if not previousChar:
-            return
-        if len(status) > 2 and status[-2] == previousChar:
-            self.textStack.pop()
-            status.pop()
-            status[-1] = parseEndStatus
-        else:
-            self.raiseError('Parse error, mismatch %s' % node[1], node)
-
     def parseSingleCondition(self, status):
         operator = None
         fieldName = None
@@ -222,104 +283,474 @@ class Parser(object):
                     value = None
                     status[-1] = 'E'
                     self.textStack.pop()
+                elif node[0] == 'list' and node[1] == '[':
+                    if operator not in self.listOperators:
+                        self.raiseError('Parse error, list not allowed for %s' % operator, node)
+                    value = self.parseList()
+                    status[-1] = 'E'
                 else:
                     self.raiseError('Parse error, should be value', node)
         status.pop()
         return ('condition', (operator, fieldName, value))
 
+    def parseList(self):
+        start = self.textStack.pop()
+        values = []
+        while len(self.textStack) > 0:
+            node = self.textStack.pop()
+            if node[0] == 'string':
+                values.append(node[1])
+            else:
+                self.raiseError('Parse error, should be value', node)
+            if len(self.textStack) == 0:
+                break
+            node = self.textStack.pop()
+            if node[0] == 'list' and node[1] == ']':
+                return values
+            elif not (node[0] == 'condition' and node[1] == ','):
+                self.raiseError('Parse error, should be , or ]', node)
+        self.raiseError('Parse error, list not closed', start)
+
     def parseCondition(self, status):
+        """
+        Parse with an explicit stack of frames, one frame [left, right, operator] per open bracket,
+        status keeps the state of every frame. Each state works as in a recursive descent,
+        brackets push a new frame and its result goes to left(S1) or right(S3) of the parent
+        """
+        frames = [[None, None, None]]
         status.append('S')
-        left_result = None
-        right_result = None
-        operator = None
-        while len(self.textStack) > 0 and status[-1] != 'E':
-            node = self.textStack[-1]
-            if status[-1] == 'S':
-                if node[0] == 'condition' and node[1] == '(':
-                    left_result = self.parsePush(node, status, self.parseCondition, 'S1')
-                elif node[0] == 'variable':
-                    left_result = self.parseSingleCondition(status)
-                    status[-1] = 'S1'
+        while True:
+            frame = frames[-1]
+            if len(self.textStack) > 0 and status[-1] != 'E':
+                node = self.textStack[-1]
+                if status[-1] == 'S' or status[-1] == 'S2':
+                    if node[0] == 'condition' and node[1] == '(':
+                        self.textStack.pop()
+                        # State of parent after the bracket is closed
+                        status[-1] = 'S1' if status[-1] == 'S' else 'S3'
+                        status.append('S')
+                        frames.append([None, None, None])
+                    elif node[0] == 'variable':
+                        if status[-1] == 'S':
+                            frame[0] = self.parseSingleCondition(status)
+                            status[-1] = 'S1'
+                        else:
+                            frame[1] = self.parseSingleCondition(status)
+                            status[-1] = 'S3'
+                    else:
+                        self.raiseError('Parse error, should be nest condition or condition', node)
+                elif status[-1] == 'S1':
+                    frame[1] = None
+                    if node[0] == 'condition' and node[1] == '|':
+                        status[-1] = 'S'
+                        frame[2] = 'or'
+                        self.textStack.pop()
+                        self.priorityStack.append(('or', frame[0]))
+                    elif node[0] == 'condition' and node[1] == ',':
+                        status[-1] = 'S2'
+                        frame[2] = 'and'
+                        self.textStack.pop()
+                    elif node[0] == 'condition' and node[1] == ')':
+                        self.closeBracket(node, status, frames)
+                    else:
+                        self.raiseError('Parse error, should be and or bracket', node)
+                elif status[-1] == 'S3':
+                    if node[0] == 'condition' and node[1] == ')':
+                        self.closeBracket(node, status, frames)
+                    elif node[0] == 'condition':
+                        status[-1] = 'S1'
+                        frame[0] = (frame[2], frame[0], frame[1])
+                    else:
+                        self.raiseError('Parse error, not be any text here', node)
+            else:
+                # Frame finished by closing bracket or end of text
+                left_result, right_result, operator = frame
+                status.pop()
+                frames.pop()
+                if operator and right_result:
+                    finalResult = ('andor', (operator, left_result, right_result))
                 else:
-                    self.raiseError('Parse error, should be nest condition or condition', node)
-            elif status[-1] == 'S1':
-                right_result = None
-                if node[0] == 'condition' and node[1] == '|':
-                    status[-1] = 'S'
-                    operator = 'or'
-                    self.textStack.pop()
-                    self.priorityStack.append(('or', left_result))
-                elif node[0] == 'condition' and node[1] == ',':
-                    status[-1] = 'S2'
-                    operator = 'and'
-                    self.textStack.pop()
-                elif node[0] == 'condition' and node[1] == ')':
-                    self.parsePop(node, status, 'E')
+                    finalResult = left_result
+                while len(self.priorityStack) > 0:
+                    (left_operator, left_result_in_stack) = self.priorityStack.pop()
+                    finalResult = (left_operator, left_result_in_stack, finalResult)
+                if not frames:
+                    return finalResult
+                if status[-1] == 'S1':
+                    frames[-1][0] = finalResult
                 else:
-                    self.raiseError('Parse error, should be and or bracket', node)
-            elif status[-1] == 'S2':
-                if node[0] == 'condition' and node[1] == '(':
-                    right_result = self.parsePush(node, status, self.parseCondition, 'S3')
-                elif node[0] == 'variable':
-                    right_result = self.parseSingleCondition(status)
-                    status[-1] = 'S3'
-                else:
-                    self.raiseError('Parse error, should be nest condition or condition', node)
-            elif status[-1] == 'S3':
-                if node[0] == 'condition' and node[1] == ')':
-                    self.parsePop(node, status, 'E')
-                elif node[0] == 'condition':
-                    if len(status) > 0:
-                        status[-1] = 'S1'
-                        left_result = (operator, left_result, right_result)
+                    frames[-1][1] = finalResult
 
-                else:
-                    self.raiseError('Parse error, not be any text here', node)
-        status.pop()
-        if operator and right_result:
-            finalResult = ('andor', (operator, left_result, right_result))
+    def closeBracket(self, node, status, frames):
+        if len(frames) > 1:
+            self.textStack.pop()
+            status[-1] = 'E'
         else:
-            finalResult = left_result
-        while len(self.priorityStack) > 0:
-            (left_operator, left_result_in_stack) = self.priorityStack.pop()
-            finalResult = (left_operator, left_result_in_stack, finalResult)
-        return finalResult
+            self.raiseError('Parse error, mismatch %s' % node[1], node)
 
     def parse(self):
         status = []
         return self.parseCondition(status)
 
+    def unwrap(self, result):
+        while result[0] == 'andor' or result[0] == 'condition':
+            result = result[1]
+        return result
+
     def loop(self, result):
-        (type, node) = result[0], result[1]
-        if type == 'andor':
-            return self.loop(node)
-        elif type == 'condition':
-            return self.loop(node)
-        n, l, r = result[0], result[1], result[2]
-        if n == 'and' or n == 'or':
-            left = self.loop(l)
-            right = self.loop(r)
-            if n == 'and':
-                return '(%s %s %s)' % (left, ' && ', right)
+        texts = []
+        stack = [result]
+        while stack:
+            node = stack.pop()
+            if type(node) is str:
+                texts.append(node)
+                continue
+            n, l, r = self.unwrap(node)
+            if n == 'and' or n == 'or':
+                stack.extend([')', r, ' %s ' % (' && ' if n == 'and' else ' || '), l, '('])
             else:
-                return '(%s %s %s)' % (left, ' || ', right)
-        else:
-            return '%s %s %s' % (l, n, r)
+                texts.append('%s %s %s' % (l, n, r))
+        return ''.join(texts)
 
     def toDict(self, result):
-        (type, node) = result[0], result[1]
-        if type == 'andor':
-            dict = self.toDict(node)
-            return dict
-        elif type == 'condition':
-            dict = self.toDict(node)
-            return dict
-        n, l, r = result[0], result[1], result[2]
-        if n == 'and' or n == 'or':
-            left = self.toDict(l)
-            right = self.toDict(r)
-            return {'opt': n, 'left': left, 'right': right}
+        root = {}
+        stack = [(result, root)]
+        while stack:
+            node, dict = stack.pop()
+            n, l, r = self.unwrap(node)
+            if n == 'and' or n == 'or':
+                left = {}
+                right = {}
+                dict['opt'] = n
+                dict['left'] = left
+                dict['right'] = right
+                stack.append((r, right))
+                stack.append((l, left))
+            else:
+                # Remove padding ' ", but allow special value None
+                if type(r) is list:
+                    r = [v[1:-1] for v in r]
+                else:
+                    r = r[1:-1] if r else None
+                dict['opt'] = n
+                dict['field'] = l
+                dict['value'] = r
+        return root
+
+
+class Optimizer(object):
+    """
+    Rewrite a condition dict from Parser.toDict into a cheaper equivalent:
+    1. Nested and/or are flattened into {'opt': 'and'|'or', 'items': [...]}
+    2. Duplicated predicates are removed
+    3. OR of equals on one field is collapsed into {'opt': '=', 'value': [...]}, i.e. __in
+    4. >= and <= on one field are merged into {'opt': '@', 'value': [low, high]}, i.e. __range
+    5. Conjunctions that never match are replaced by {'opt': 'false'}
+    Values are only compared as given, a rewrite never depends on collation or type of the field
+    """
+
+    def optimize(self, conditions):
+        if not conditions or not self.isNode(conditions):
+            return conditions
+        results = {}
+        keys = {}
+        stack = [(conditions, None)]
+        while stack:
+            node, operands = stack.pop()
+            if operands is None:
+                operands = self.operands(node)
+                stack.append((node, operands))
+                for operand in operands:
+                    if self.isNode(operand):
+                        stack.append((operand, None))
+            else:
+                items = [results.pop(id(operand), operand) for operand in operands]
+                result = self.reduce(node['opt'], items, keys)
+                results[id(node)] = result
+        return results[id(conditions)]
+
+    def isNode(self, conditions):
+        opt = conditions.get('opt', None)
+        return opt == 'and' or opt == 'or'
+
+    def children(self, node):
+        items = node.get('items', None)
+        if items is None:
+            return [node['left'], node['right']]
+        return items
+
+    def operands(self, node):
+        """Operands of node with all nested nodes of same operator flattened, in text order"""
+        opt = node['opt']
+        result = []
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            if n.get('opt', None) == opt:
+                stack.extend(reversed(self.children(n)))
+            else:
+                result.append(n)
+        return result
+
+    def key(self, item, keys):
+        if self.isNode(item):
+            return keys[id(item)]
+        value = item.get('value', None)
+        if type(value) is list:
+            value = frozenset(value) if item['opt'] == '=' else tuple(value)
+        return (item['opt'], item.get('field', None), value)
+
+    def reduce(self, opt, items, keys):
+        unique = []
+        seen = set()
+        for item in items:
+            if item['opt'] == 'false':
+                if opt == 'and':
+                    return {'opt': 'false'}
+                continue
+            for i in (item['items'] if item['opt'] == opt else [item]):
+                k = self.key(i, keys)
+                if k not in seen:
+                    seen.add(k)
+                    unique.append(i)
+        if opt == 'or':
+            unique = self.collapseEquals(unique)
+        else:
+            unique = self.mergeRanges(unique)
+            if self.isContradiction(unique):
+                return {'opt': 'false'}
+        if not unique:
+            return {'opt': 'false'}
+        if len(unique) == 1:
+            return unique[0]
+        result = {'opt': opt, 'items': unique}
+        keys[id(result)] = (opt, frozenset(self.key(i, keys) for i in unique))
+        return result
+
+    def collapseEquals(self, items):
+        groups = {}
+        for item in items:
+            if item['opt'] == '=' and item.get('value', None) is not None:
+                groups.setdefault(item['field'], []).append(item)
+        result = []
+        for item in items:
+            group = groups.get(item.get('field', None), None) if item['opt'] == '=' else None
+            if not group or len(group) < 2 or item.get('value', None) is None:
+                result.append(item)
+            elif item is group[0]:
+                values = []
+                for i in group:
+                    values.extend(i['value'] if type(i['value']) is list else [i['value']])
+                result.append({'opt': '=', 'field': item['field'], 'value': list(dict.fromkeys(values))})
+        return result
+
+    def mergeRanges(self, items):
+        lows = {}
+        highs = {}
+        for item in items:
+            value = item.get('value', None)
+            if value is not None and type(value) is not list:
+                if item['opt'] == '>=':
+                    lows.setdefault(item['field'], item)
+                elif item['opt'] == '<=':
+                    highs.setdefault(item['field'], item)
+        ranges = {}
+        for field, low in lows.items():
+            if field in highs:
+                ranges[field] = {'opt': '@', 'field': field, 'value': [low['value'], highs[field]['value']]}
+        if not ranges:
+            return items
+        result = []
+        for item in items:
+            field = item.get('field', None)
+            if field in lows and (item is lows[field] or item is highs.get(field, None)):
+                # Merged range takes position of whichever comes first
+                rangeItem = ranges.pop(field, None)
+                if rangeItem:
+                    result.append(rangeItem)
+                elif field in highs:
+                    continue
+                else:
+                    result.append(item)
+            else:
+                result.append(item)
+        return result
+
+    def isContradiction(self, items):
+        """
+        Only a field equal to values all of which it is also not equal to, by identical values. Different
+        values may still match the same rows, e.g. 'A' and 'a' by case insensitive collation or '1' and '01'
+        on a number field, so they never make a contradiction
+        """
+        equals = []
+        notEquals = {}
+        for item in items:
+            opt, value = item['opt'], item.get('value', None)
+            if opt == '=' and value is not None:
+                equals.append((item['field'], value if type(value) is list else [value]))
+            elif opt == '!=' and value is not None and type(value) is not list:
+                notEquals.setdefault(item['field'], set()).add((type(value), value))
+        for field, values in equals:
+            excluded = notEquals.get(field, None)
+            if excluded and all((type(v), v) in excluded for v in values):
+                return True
+        return False
+
+
+class QueryParameter(object):
+    """Placeholder of a literal in query plan, a list literal is spread into the list value it is in"""
+    __slots__ = ('index', 'isList')
+
+    def __init__(self, index, isList=False):
+        self.index = index
+        self.isList = isList
+
+    def bind(self, values, target):
+        if self.isList:
+            target.extend(values[self.index])
         else:
-            # Remove padding ' ", but allow special value None
-            r = r[1:-1] if r else None
-            return {'opt': n, 'field': l, 'value': r}
+            target.append(values[self.index])
+
+
+class QueryPlan(object):
+    """
+    Parsed filter whose literal values are lifted out as positional parameters, optimized once by Optimizer.
+    Parameters are different values to Optimizer, rewrites of the template hold whatever values are bound
+    """
+
+    def __init__(self, template):
+        # Placeholder values of the template are parameter index strings, see QueryPlanCache,
+        # index of a list literal parameter is kept in a list, i.e. [index]
+        stack = [template]
+        while stack:
+            node = stack.pop()
+            if 'left' in node:
+                stack.append(node['left'])
+                stack.append(node['right'])
+            elif node.get('value', None) is not None:
+                value = node['value']
+                node['value'] = [QueryParameter(int(value[0]), True)] if type(value) is list \
+                    else QueryParameter(int(value))
+        self.template = template
+        self.optimized = None
+
+    def bind(self, values, optimized=False):
+        """Return a new condition dict of template, or of optimized template, with given parameter values"""
+        if optimized:
+            if self.optimized is None:
+                self.optimized = Optimizer().optimize(self.template)
+            template = self.optimized
+        else:
+            template = self.template
+        result = {}
+        stack = [(template, result)]
+        while stack:
+            source, target = stack.pop()
+            for k, v in source.items():
+                if k == 'left' or k == 'right':
+                    child = {}
+                    target[k] = child
+                    stack.append((v, child))
+                elif k == 'items':
+                    children = target[k] = [{} for item in v]
+                    stack.extend(zip(v, children))
+                elif k == 'value' and v is not None:
+                    if type(v) is list:
+                        value = []
+                        for parameter in v:
+                            parameter.bind(values, value)
+                        target[k] = value
+                    else:
+                        target[k] = values[v.index]
+                else:
+                    target[k] = v
+        return result
+
+
+class QueryPlanCache(object):
+    """
+    LRU cache of query plans keyed by the normalized filter text, i.e. the token stream with
+    every string literal replaced by ? and every list literal by [*], so name='a' and name='b',
+    id=['1'] and id=['1','2'] share the same plan. Plan and values of a repeated filter text are
+    looked up by the text itself, without tokenizing it again
+    """
+    # Longer texts are tokenized each time, they are rarely repeated
+    maxTextLength = 2048
+
+    def __init__(self, maxSize=512, limits=None):
+        self.cache = LRUCache(maxSize)
+        self.texts = LRUCache(maxSize)
+        self.limits = limits
+
+    def getPlan(self, text):
+        """Return (plan, values), bind values into plan to get the condition dict"""
+        cacheText = len(text) <= self.maxTextLength
+        if cacheText:
+            entry = self.texts.get(text)
+            if entry is not None:
+                return entry
+        plan, values = self.parsePlan(text)
+        if cacheText:
+            # values are only read by bind
+            self.texts.put(text, (plan, values))
+        return plan, values
+
+    def parsePlan(self, text):
+        parser = Parser(text, limits=self.limits)
+        # textStack is in reversed order
+        tokens = parser.textStack
+        templateTokens = []
+        keyParts = []
+        values = []
+        listValues = None
+        for i in range(len(tokens) - 1, -1, -1):
+            token = tokens[i]
+            kind, word = token[0], token[1]
+            if listValues is not None:
+                # Inside list literal, whole list is passed as one parameter
+                expectValue = len(listValues) == 0 or tokens[i + 1][0] == 'condition'
+                if kind == 'string' and expectValue:
+                    listValues.append(word[1:-1])
+                elif kind == 'condition' and word == ',' and not expectValue:
+                    pass
+                elif kind == 'list' and word == ']' and not expectValue:
+                    templateTokens.append(('string', "'%d'" % len(values), token[2]))
+                    templateTokens.append(token)
+                    values.append(listValues)
+                    listValues = None
+                    keyParts.append('[*]')
+                else:
+                    break
+            elif kind == 'list' and word == '[':
+                listValues = []
+                templateTokens.append(token)
+            elif kind == 'string':
+                keyParts.append('?')
+                templateTokens.append((kind, "'%d'" % len(values), token[2]))
+                values.append(word[1:-1])
+            else:
+                keyParts.append(word)
+                templateTokens.append(token)
+        if listValues is not None:
+            # Malformed list literal, parse original text to report the error
+            parser.parse()
+            raise Exception('Parse error, invalid list')
+        key = ' '.join(keyParts)
+        plan = self.cache.get(key)
+        if plan is None:
+            templateTokens.reverse()
+            parser.textStack = templateTokens
+            plan = QueryPlan(parser.toDict(parser.parse()))
+            self.cache.put(key, plan)
+        return plan, values
+
+    def clear(self):
+        self.cache.clear()
+        self.texts.clear()
+
+    def stats(self):
+        stats = self.cache.stats()
+        textStats = self.texts.stats()
+        stats['textHits'] = textStats['hits']
+        stats['textMisses'] = textStats['misses']
+        return stats
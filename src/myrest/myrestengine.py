@@ -1,15 +1,17 @@
 # -*- coding: UTF-8 -*-
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.utils.cache import patch_vary_headers
 from .myparser import *
-from xml.etree.ElementTree import Element, tostring, fromstring
+from .mycache import LRUCache, LocalResultCache
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Q, F, Count, Window
 from django.db.models.query import QuerySet
-from django.db import transaction
+from django.db import transaction, connections
 from django.core.exceptions import *
 from django.conf import settings
-from functools import reduce
-import random, re, pickle, yaml, base64, json, time, datetime, math
+from types import MappingProxyType, FunctionType
+import re, json, time, datetime, decimal, math, os, threading, itertools, hashlib, operator, zlib, copy
 
 VERSION = '0.1.9'
 
@@ -64,106 +66,167 @@ class ReadErrorException(BadRequestException):
     pass
 
 
+def freezeValue(value):
+    """Read only copy of parsed yaml value, dicts as MappingProxyType and lists as tuples"""
+    if isinstance(value, (dict, MappingProxyType)):
+        return MappingProxyType({k: freezeValue(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freezeValue(v) for v in value)
+    return value
+
+
+def thawValue(value):
+    """Plain dicts and lists of value from freezeValue, changes don't reach the frozen value"""
+    if isinstance(value, MappingProxyType):
+        return {k: thawValue(v) for k, v in value.items()}
+    if type(value) is tuple:
+        return [thawValue(v) for v in value]
+    return value
+
+
+class EntitySchema(object):
+    """
+    Immutable definition of one entity compiled from metadata, with maps for field lookup. Field definitions
+    are frozen copies, changes of metadata dict after loading don't reach the schema
+    """
+    __slots__ = ('name', 'definition', 'keys', 'keyNames', 'keyMap', 'properties', 'propertyMap', 'fieldMap',
+                 'fieldTypes', 'expandNames', 'expandMap', 'mandatoryFields', 'updatableFields', 'creatable',
+                 'updatable', 'deletable', 'streaming', 'selectRelated', 'prefetchRelated', 'cacheTTL')
+
+    def __init__(self, name, entityDef):
+        entityDef = freezeValue(entityDef)
+        keys = entityDef.get('key', None) or ()
+        properties = entityDef.get('property', None) or ()
+        expands = entityDef.get('expand', None) or ()
+        values = {
+            'name': name,
+            'definition': entityDef,
+            'keys': keys,
+            'keyNames': tuple(item['name'] for item in keys),
+            'keyMap': MappingProxyType({item['name']: item for item in keys}),
+            'properties': properties,
+            'propertyMap': MappingProxyType({item['name']: item for item in properties}),
+            'fieldMap': MappingProxyType({item['name']: item for item in keys + properties}),
+            'fieldTypes': MappingProxyType({item['name']: item.get('type', None) for item in keys + properties}),
+            'expandNames': tuple(item['name'] for item in expands),
+            'expandMap': MappingProxyType({item['name']: item['type'] for item in expands}),
+            'mandatoryFields': tuple(item['name'] for item in keys + properties if not item.get('nullable', True)),
+            'updatableFields': frozenset(item['name'] for item in properties if item.get('updatable', False)),
+            'creatable': bool(entityDef.get('creatable', False)),
+            'updatable': bool(entityDef.get('updatable', False)),
+            'deletable': bool(entityDef.get('deletable', False)),
+            # False, True or chunk size of streamed list response
+            'streaming': entityDef.get('streaming', False),
+            # Related objects joined or prefetched when rows are read as model objects
+            'selectRelated': tuple(entityDef.get('selectRelated', None) or []),
+            'prefetchRelated': tuple(entityDef.get('prefetchRelated', None) or []),
+            # Seconds list and single results are kept in result cache, None not cached
+            'cacheTTL': entityDef.get('cacheTTL', None)
+        }
+        for k, v in values.items():
+            object.__setattr__(self, k, v)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('EntitySchema is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('EntitySchema is immutable')
+
+
+def loadYaml(stream):
+    # yaml is only imported when metadata is not loaded from snapshot
+    import yaml
+    return yaml.load(stream, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
 class MetadataUtil(object):
+    __versions = itertools.count(1)
+
     def __init__(self, metadata):
-        self.metadata = yaml.load(metadata)
-        self.fieldCache = {}
-        self.keyFieldCache = {}
-        self.mandatoryFeildCache = {}
-        self.updatableFieldCache = {}
-        self.deletableCache = {}
-        self.creatableCache = {}
-        self.updatableCache = {}
-
-        for k, v in self.metadata.get('sets', {}).items():
-            entity = self.metadata.get(v, {})
-            self.fieldCache.setdefault(v, {})
-            self.keyFieldCache.setdefault(v, {})
-            self.mandatoryFeildCache.setdefault(v, [])
-            self.updatableFieldCache.setdefault(v, [])
-            for item in entity.get('key', []):
-                self.fieldCache[v][item['name']] = item
-                self.keyFieldCache[v][item['name']] = item
-                if not item.get('nullable', True):
-                    self.mandatoryFeildCache[v].append(item['name'])
-            properties = entity.get('property', [])
-            for item in properties:
-                self.fieldCache[v][item['name']] = item
-                if not item.get('nullable', True):
-                    self.mandatoryFeildCache[v].append(item['name'])
-                if item.get('updatable', False):
-                    self.updatableFieldCache[v].append(item['name'])
-            self.deletableCache.setdefault(v, bool(entity.get('deletable', False)))
-            self.creatableCache.setdefault(v, bool(entity.get('creatable', False)))
-            self.updatableCache.setdefault(v, bool(entity.get('updatable', False)))
+        # Parsed metadata dict or yaml stream
+        self.metadata = metadata if type(metadata) is dict else loadYaml(metadata)
+        # Entity name -> EntitySchema
+        self.schemas = {}
+        for k, v in self.metadata.items():
+            if k != 'sets' and type(v) is dict:
+                self.schemas[k] = EntitySchema(k, v)
+        # Entity name -> names of entities with an expand item of it
+        self.expandingEntities = {}
+        for name, schema in self.schemas.items():
+            for expandType in schema.expandMap.values():
+                expanded = self.getEntityNameOfType(expandType)
+                if expanded is not None and name not in self.expandingEntities.setdefault(expanded, []):
+                    self.expandingEntities[expanded].append(name)
+        # Increases with each load, state compiled from metadata is bound to its version
+        self.version = next(MetadataUtil.__versions)
+        # Set by engine, replaced together with metadata on reload
+        self.routeTable = None
+        # Serialized responses of metadata only requests, e.g. _metadata
+        self.responseCache = {}
+
+    def getEntitySchema(self, entityName):
+        return self.schemas.get(entityName, None)
 
     def getFieldDef(self, entityName, fieldName):
-        cache = self.fieldCache.get(entityName, None)
-        return cache.get(fieldName, None) if cache else None
+        schema = self.schemas.get(entityName, None)
+        return thawValue(schema.fieldMap.get(fieldName, None)) if schema else None
 
     def getMandatoryFields(self, entityName):
-        return self.mandatoryFeildCache[entityName]
+        return list(self.schemas[entityName].mandatoryFields)
 
     def getEntityDef(self, entityName):
         return self.metadata.get(entityName, None)
 
     def isKeyField(self, entityName, fieldName):
-        cache = self.keyFieldCache.get(entityName, None)
-        if cache.get(fieldName, None):
-            return True
-        return False
+        schema = self.schemas.get(entityName, None)
+        return schema is not None and fieldName in schema.keyMap
 
     def isFieldUpdatable(self, entityName, fieldName):
-        cache = self.updatableFieldCache.get(entityName, None)
-        if fieldName in cache:
-            return True
-        return False
+        schema = self.schemas.get(entityName, None)
+        return schema is not None and fieldName in schema.updatableFields
 
     def isEntityDeletable(self, entityName):
-        return self.deletableCache.get(entityName, False)
+        schema = self.schemas.get(entityName, None)
+        return schema is not None and schema.deletable
 
     def isEntityCreatable(self, entityName):
-        return self.creatableCache.get(entityName, False)
+        schema = self.schemas.get(entityName, None)
+        return schema is not None and schema.creatable
 
     def isEntityUpdatable(self, entityName):
-        return self.updatableCache.get(entityName, False)
+        schema = self.schemas.get(entityName, None)
+        return schema is not None and schema.updatable
 
     def getKeyFieldDef(self, entityName, keyName=None):
-        entityDef = self.getEntityDef(entityName)
+        schema = self.schemas[entityName]
         if keyName:
-            result = None
-            for key in entityDef['key']:
-                if keyName == key['name']:
-                    result = key
-                    break
-            return result
+            return thawValue(schema.keyMap.get(keyName, None))
         else:
-            return entityDef['key']
+            return thawValue(schema.keys)
 
     def getProperyFeildDef(self, entityName, propertyName=None):
-        entityDef = self.getEntityDef(entityName)
+        schema = self.schemas[entityName]
         if propertyName:
-            result = None
-            for property in entityDef['property']:
-                if propertyName == property['name']:
-                    result = property
-                    break
-            return result
+            return thawValue(schema.propertyMap.get(propertyName, None))
         else:
-            return entityDef['property']
+            return thawValue(schema.properties)
 
     def getExpandFieldDef(self, entityName):
-        entityDef = self.getEntityDef(entityName)
-        expandList = [item['name'] for item in entityDef.get('expand', [])]
-        return expandList
+        return list(self.schemas[entityName].expandNames)
 
     def getExpandFieldSetType(self, entityName, expandName):
-        try:
-            for item in self.metadata[entityName]['expand']:
-                if item['name'] == expandName:
-                    return item['type']
-        except Exception as e:
-            return None
+        schema = self.schemas.get(entityName, None)
+        return schema.expandMap.get(expandName, None) if schema else None
+
+    def getEntityNameOfType(self, name):
+        """Entity of an expand type, the entity itself or entity of a set"""
+        if name in self.schemas:
+            return name
+        return self.metadata.get('sets', {}).get(name, None)
+
+    def getExpandingEntityNames(self, entityName):
+        """Entities with an expand item of entityName"""
+        return list(self.expandingEntities.get(entityName, ()))
 
     def getEntityTypeOfName(self, name):
         if name in self.metadata:
@@ -173,78 +236,873 @@ class MetadataUtil(object):
         raise InternalException('Wrong name, not list or single')
 
     def checkKeyCount(self, entityName):
-        entityDef = self.metadata.get(entityName, None)
-        if not entityDef:
-            return 0
-        return len(entityDef.get('key', []))
+        schema = self.schemas.get(entityName, None)
+        return len(schema.keys) if schema else 0
 
     def checkKeyName(self, entityName, keyName):
-        entityDef = self.metadata.get('entityName', None)
-        if not entityDef:
-            return False
-        found = False
-        for key in entityDef['key']:
-            if keyName == key['name']:
-                found = True
-                break
-        return found
+        schema = self.schemas.get(entityName, None)
+        return schema is not None and keyName in schema.keyMap
 
-    def checkFieldValueByType(self, value, type):
+    intPattern = re.compile("^[\d]*$")
+
+    @staticmethod
+    def intKeyValue(value):
+        if not MetadataUtil.intPattern.match(value):
+            raise MetadataException("Value %s doesn't match int type" % value)
+        return int(value)
+
+    @staticmethod
+    def stringKeyValue(value):
+        if len(value) < 2:
+            raise MetadataException("Value %s must contains \" or \' and length > 2" % value)
+        if (value[0] == '"' and value[-1] == '"') or (value[0] == "'" and value[-1] == "'"):
+            return value[1:-1]
+        else:
+            raise MetadataException("Mismatch \" or \' for string type")
+
+    def getFieldValueConverter(self, type):
+        """Return function converting key value text in url of given type"""
         if type == 'int':
-            if not re.compile("^[\d]*$").match(value):
-                raise MetadataException("Value %s doesn't match int type" % value)
-            return int(value)
+            return self.intKeyValue
         elif type == 'string':
-            if len(value) < 2:
-                raise MetadataException("Value %s must contains \" or \' and length > 2" % value)
-            if (value[0] == '"' and value[-1] == '"') or (value[0] == "'" and value[-1] == "'"):
-                return value[1:-1]
+            return self.stringKeyValue
+        return lambda value: None
+
+    def checkFieldValueByType(self, value, type):
+        return self.getFieldValueConverter(type)(value)
+
+
+class RouteTable(object):
+    """
+    Url path resolver compiled from metadata: entity sets with their key converters and valid
+    navigations, resolved paths are kept in LRU cache
+    """
+    pathPattern = re.compile(r'(\w*)(\(.*\))?')
+
+    def __init__(self, metadataUtil, cacheSize=1024):
+        # Entity set name -> (entity name, key names, key converters, key converter by name)
+        self.sets = {}
+        # Entity name -> navigation names
+        self.navigations = {}
+        for entitySet, entityName in metadataUtil.metadata.get('sets', {}).items():
+            schema = metadataUtil.getEntitySchema(entityName)
+            if not entityName or not schema or not schema.definition:
+                self.sets[entitySet] = (entityName, None, None, None)
+                continue
+            converters = [metadataUtil.getFieldValueConverter(k['type']) for k in schema.keys]
+            self.sets[entitySet] = (entityName, schema.keyNames, converters, dict(zip(schema.keyNames, converters)))
+            self.navigations[entityName] = schema.expandMap
+        self.cache = LRUCache(cacheSize)
+
+    def resolve(self, path):
+        """Return list of entity info of each path segment, raise exception if path is invalid"""
+        entityInfos = self.cache.get(path)
+        if entityInfos is None:
+            pathArray = path.split('/')
+            entityInfos = [self.parseSegment(segment) for segment in pathArray]
+            for i in range(len(pathArray) - 1):
+                parentEntityName = entityInfos[i]['entityName']
+                if pathArray[i + 1] not in self.navigations[parentEntityName]:
+                    raise InternalException('Navigation %s is not valid from parent %s' % (pathArray[i + 1],
+                                                                                          parentEntityName))
+                if not entityInfos[i]['keys']:
+                    # Parent entity must contain keys for cascade relationship
+                    raise InternalException('Keys must be provided for %s' % parentEntityName)
+            self.cache.put(path, entityInfos)
+        # Copy, cached entries must not be changed by processors
+        return [dict(entityInfo, keys={k: dict(v) for k, v in entityInfo['keys'].items()})
+                for entityInfo in entityInfos]
+
+    def parseSegment(self, urlPath):
+        regItem = self.pathPattern.match(urlPath)
+        if not regItem:
+            raise ParameterErrorException('Wrong Url pattern')
+        entitySet = regItem.group(1)
+        if not entitySet:
+            raise ParameterErrorException('No entity set name found')
+        route = self.sets.get(entitySet, None)
+        if not route or not route[0]:
+            raise ParameterErrorException('Invalid entity name')
+        entityName, keyNames, converters, converterByName = route
+        if keyNames is None:
+            raise ParameterErrorException('Entity metadata not found')
+        keys = {}
+        if regItem.group(2):
+            keysArray = regItem.group(2)[1:-1].split(',')
+            if len(keysArray) != len(keyNames):
+                raise ParameterErrorException('key fields length mismatch')
+            if len(keysArray) == 1:
+                value = converters[0](keysArray[0])
+                if not value:
+                    raise ParameterErrorException('Wrong key value %s' % value)
+                keys[entityName] = {keyNames[0]: value}
             else:
-                raise MetadataException("Mismatch \" or \' for string type")
+                keyPairs = {}
+                # Validate key pairs pattern
+                # Pattern 1 entity(key1='value', key2='value2')
+                # Pattern 2 entity('value','value2)
+                keyValues = [key.split('=') for key in keysArray]
+                if all(len(keyValue) == 2 for keyValue in keyValues):
+                    for keyValue in keyValues:
+                        key, value = keyValue[0].strip(), keyValue[1].strip()
+                        converter = converterByName.get(key, None)
+                        if not converter:
+                            raise ParameterErrorException('Wrong key %s' % key)
+                        value = converter(value)
+                        if not value:
+                            raise ParameterErrorException('Wrong key value %s' % value)
+                        keyPairs[key] = value
+                elif all(len(keyValue) == 1 for keyValue in keyValues):
+                    for value, keyName, converter in zip(keysArray, keyNames, converters):
+                        value = converter(value.strip())
+                        if not value:
+                            raise ParameterErrorException('Wrong key value')
+                        keyPairs[keyName] = value
+                else:
+                    raise ParameterErrorException("Either use key=value or 'value', but not mixed")
+                keys[entityName] = keyPairs
+            queryType = "single"
+        else:
+            queryType = "list"
+        return {
+            'entitySet': entitySet,
+            'entityName': entityName,
+            'queryType': queryType,
+            'keys': keys
+        }
+
+
+class CompiledMapping(object):
+    """Base of processor field mappings compiled once, keeps the mapping to tell if it has changed"""
+    fieldPattern = re.compile(r'^[A-Za-z_]\w*(\.[A-Za-z_]\w*)*$')
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    @staticmethod
+    def splitField(field):
+        if type(field) is tuple:
+            return field[0], field[1]
+        return field, field
+
+    def matches(self, fields):
+        if fields is self.fields:
+            return True
+        if len(fields) != len(self.fields):
+            return False
+        for field, compiled in zip(fields, self.fields):
+            if field == compiled:
+                continue
+            # Mapping returning new lambdas on each call still matches when code and captured values are same
+            if type(field) is not tuple or type(compiled) is not tuple or len(field) != len(compiled) \
+                    or field[0] != compiled[0] or not self.sameFunction(field[1], compiled[1]):
+                return False
+        return True
+
+    @staticmethod
+    def sameFunction(f1, f2):
+        if type(f1) is not FunctionType or type(f2) is not FunctionType:
+            return False
+        if f1.__code__ is not f2.__code__ or f1.__defaults__ != f2.__defaults__:
+            return False
+        cells1, cells2 = f1.__closure__ or (), f2.__closure__ or ()
+        return len(cells1) == len(cells2) and all(c1.cell_contents is c2.cell_contents
+                                                  for c1, c2 in zip(cells1, cells2))
+
+
+class RowSerializer(CompiledMapping):
+    """
+    Populate field mapping compiled once into a getter per field: attrgetter for model fields,
+    the function itself for callables and a constant for dict values, reused for every row.
+    Datetime values are formatted with formatDateTime when given, see setRawDateTime of engine
+    """
+
+    def __init__(self, fields):
+        CompiledMapping.__init__(self, fields)
+        # What each field reads: model attribute path, constant value or None if not known, e.g. function
+        self.sources = []
+        # (json field, getter of model)
+        self.getters = [self.compileField(field) for field in fields]
+        # Requested json fields -> RowSerializer of them
+        self.projections = {}
+        # Model class -> ValuesRowSerializer or None if mapping needs model objects
+        self.valuesSerializers = {}
+        # Model class -> select_related lookups of dotted fields
+        self.relatedLookups = {}
+
+    def compileField(self, field):
+        jfield, mfield = self.splitField(field)
+        if callable(mfield):
+            self.sources.append(None)
+            return jfield, mfield
+        if type(mfield) is dict:
+            value = mfield.get('value', None)
+            self.sources.append(('constant', value))
+            return jfield, lambda djangoModel: value
+        if self.fieldPattern.match(mfield):
+            self.sources.append(mfield)
+            return jfield, operator.attrgetter(mfield)
+        self.sources.append(None)
+        # Other python expressions on model, e.g. items[0], are compiled once
+        code = compile('djangoModel.%s' % mfield, '<mapping %s>' % jfield, 'eval')
+        return jfield, lambda djangoModel: eval(code, globals(), {'djangoModel': djangoModel})
+
+    def project(self, reqFields):
+        """Serializer of requested json fields only, fields not requested are not evaluated"""
+        key = frozenset(reqFields)
+        projected = self.projections.get(key, None)
+        if projected is None:
+            projected = RowSerializer([field for field in self.fields if self.splitField(field)[0] in key])
+            if len(self.projections) < 64:
+                self.projections[key] = projected
+        return projected
+
+    def getModelFields(self, djangoModel):
+        """Names of model fields read by mapping, None if it can't be told, e.g. mapping has functions or properties"""
+        names = {}
+        for field in djangoModel._meta.concrete_fields:
+            names[field.name] = field.name
+            names[field.attname] = field.name
+        fields = []
+        for source in self.sources:
+            if source is None:
+                return None
+            if type(source) is tuple:
+                continue
+            # Related object, e.g. org of org.name, is loaded as before
+            name = names.get(source.split('.', 1)[0], None)
+            if name is None:
+                return None
+            if name not in fields:
+                fields.append(name)
+        return fields
+
+    def getValuesSerializer(self, djangoModel):
+        """
+        ValuesRowSerializer reading rows with values_list, None if any field needs model object, e.g.
+        function, property, related object itself or field of a to-many relation
+        """
+        if djangoModel in self.valuesSerializers:
+            return self.valuesSerializers[djangoModel]
+        lookups = []
+        values = []
+        for source in self.sources:
+            if type(source) is tuple:
+                values.append(source)
+                continue
+            lookup = self.getValueLookup(djangoModel, source) if source else None
+            if lookup is None:
+                lookups = None
+                break
+            values.append(len(lookups))
+            lookups.append(lookup)
+        if lookups:
+            jfields = [jfield for jfield, getter in self.getters]
+            dateTimes = [jfield for jfield, value in zip(jfields, values)
+                         if (type(value) is int and self.isDateTimeLookup(djangoModel, lookups[value])) or
+                         (type(value) is tuple and type(value[1]) is datetime.datetime)]
+            serializer = ValuesRowSerializer(jfields, lookups, values, dateTimes)
+        else:
+            serializer = None
+        self.valuesSerializers[djangoModel] = serializer
+        return serializer
+
+    def getSelectRelated(self, djangoModel):
+        """Related objects read by dotted fields, e.g. org of org.name, to be loaded with select_related"""
+        lookups = self.relatedLookups.get(djangoModel, None)
+        if lookups is None:
+            lookups = []
+            for source in self.sources:
+                lookup = self.getRelatedLookup(djangoModel, source) if type(source) is str else None
+                if lookup and lookup not in lookups:
+                    lookups.append(lookup)
+            self.relatedLookups[djangoModel] = lookups
+        return lookups
+
+    @staticmethod
+    def getRelatedLookup(djangoModel, path):
+        """Chain of foreign keys and one to ones in attribute path, e.g. org__parent of org.parent.name"""
+        from django.core.exceptions import FieldDoesNotExist
+        model = djangoModel
+        names = []
+        for name in path.split('.'):
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                break
+            # attname, e.g. org_id, is a value of the row itself
+            if name != field.name or not ((field.many_to_one and field.concrete) or field.one_to_one):
+                break
+            names.append(name)
+            model = field.related_model
+        return '__'.join(names)
+
+    @staticmethod
+    def isDateTimeLookup(djangoModel, lookup):
+        """If values_list lookup, e.g. org__createdAt, reads a DateTimeField"""
+        from django.core.exceptions import FieldDoesNotExist
+        from django.db.models import DateTimeField
+        model = djangoModel
+        names = lookup.split('__')
+        try:
+            for name in names[:-1]:
+                model = model._meta.get_field(name).related_model
+            field = model._meta.get_field(names[-1])
+        except FieldDoesNotExist:
+            # attname of foreign key, e.g. org_id
+            return False
+        return isinstance(field, DateTimeField)
+
+    @staticmethod
+    def getValueLookup(djangoModel, path):
+        """Lookup of attribute path for values_list, e.g. org.name to org__name, None if not a plain value"""
+        from django.core.exceptions import FieldDoesNotExist
+        model = djangoModel
+        names = path.split('.')
+        for i, name in enumerate(names):
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                # attname of foreign key, e.g. org_id
+                field = next((f for f in model._meta.concrete_fields if f.attname == name), None)
+                if field is None or i < len(names) - 1:
+                    return None
+                continue
+            if i < len(names) - 1:
+                # Only through foreign key or one to one, other relations give more rows
+                if not (field.many_to_one or field.one_to_one) or not field.concrete:
+                    return None
+                model = field.related_model
+            elif not field.concrete or (field.is_relation and name != field.attname):
+                # Related object itself, its id is given by attname, e.g. org_id
+                return None
+        return '__'.join(names)
+
+    def serialize(self, djangoModel, reqFields=None, formatDateTime=None):
+        if reqFields:
+            return self.project(reqFields).serialize(djangoModel, formatDateTime=formatDateTime)
+        record = {}
+        for jfield, getter in self.getters:
+            value = getter(djangoModel)
+            if formatDateTime is not None and type(value) is datetime.datetime:
+                value = formatDateTime(value)
+            record[jfield] = value
+        return record
+
+
+class ValuesRowSerializer(object):
+    """Rows from values_list tuples into records of RowSerializer, without creating model objects"""
+
+    def __init__(self, jfields, lookups, values, dateTimes=()):
+        self.jfields = jfields
+        # Arguments of values_list
+        self.lookups = lookups
+        # Index in values_list tuple or ('constant', value) of each json field
+        self.values = values
+        # Json fields with datetime values
+        self.dateTimes = dateTimes
+        self.direct = values == list(range(len(lookups)))
+
+    def serialize(self, row):
+        if self.direct:
+            return dict(zip(self.jfields, row))
+        return dict(zip(self.jfields, [row[v] if type(v) is int else v[1] for v in self.values]))
+
+    def iterSerialize(self, rows, formatDateTime=None):
+        if self.direct:
+            jfields = self.jfields
+            records = (dict(zip(jfields, row)) for row in rows)
+        else:
+            records = (self.serialize(row) for row in rows)
+        if formatDateTime is None or not self.dateTimes:
+            return records
+        return self.formatDateTimes(records, formatDateTime)
+
+    def formatDateTimes(self, records, formatDateTime):
+        dateTimes = self.dateTimes
+        for record in records:
+            for jfield in dateTimes:
+                value = record[jfield]
+                if value is not None:
+                    record[jfield] = formatDateTime(value)
+            yield record
+
+
+class ModelPopulator(CompiledMapping):
+    """
+    Populate model mapping compiled with metadata field types into a setter per field,
+    json values are converted by field type and set with setattr
+    """
+
+    def __init__(self, fields, schema, usage, version=None):
+        CompiledMapping.__init__(self, fields)
+        self.usage = usage
+        # Metadata version the field types are taken from
+        self.version = version
+        fieldTypes = schema.fieldTypes if schema else {}
+        # Model field returned by mapping function -> setter of it
+        self.pathSetters = {}
+        # (json field, setter of model and value)
+        self.setters = []
+        for field in fields:
+            jfield, mfield = self.splitField(field)
+            if usage == 'UPDATE':
+                # Ignore key field and non-updatable fields
+                if schema is None or jfield in schema.keyMap or jfield not in schema.updatableFields:
+                    continue
+            self.setters.append((jfield, self.compileField(jfield, mfield, fieldTypes.get(jfield, None))))
+
+    @staticmethod
+    def toInt(value):
+        if type(value) is str:
+            return int(value.strip())
+        if isinstance(value, (int, float)):
+            return value
+        raise ValueError('%s is not int' % value)
+
+    @staticmethod
+    def toFloat(value):
+        if type(value) is str:
+            return float(value.strip())
+        if isinstance(value, (int, float)):
+            return value
+        raise ValueError('%s is not float' % value)
+
+    @staticmethod
+    def toBoolean(value):
+        if type(value) is str:
+            text = value.strip().lower()
+            if text in ('true', '1'):
+                return True
+            if text in ('false', '0'):
+                return False
+            raise ValueError('%s is not boolean' % value)
+        if isinstance(value, (int, float)):
+            return bool(value)
+        raise ValueError('%s is not boolean' % value)
+
+    converters = {
+        'int': toInt.__func__,
+        'float': toFloat.__func__,
+        'boolean': toBoolean.__func__
+    }
+
+    @classmethod
+    def compilePath(cls, path):
+        """Return setter of model attribute path, e.g. name or org.name"""
+        if type(path) is not str or not cls.fieldPattern.match(path):
+            raise InternalException('Model field %s is not an attribute name' % str(path))
+        parent, _, name = path.rpartition('.')
+        if not parent:
+            return lambda djangoModel, value: setattr(djangoModel, name, value)
+        getParent = operator.attrgetter(parent)
+        return lambda djangoModel, value: setattr(getParent(djangoModel), name, value)
+
+    def getPathSetter(self, path):
+        """Setter of model field returned by mapping function, compiled once per field"""
+        # Not a field name, e.g. list, is rejected by compilePath
+        setter = self.pathSetters.get(path, None) if type(path) is str else None
+        if setter is None:
+            setter = self.compilePath(path)
+            if len(self.pathSetters) < 64:
+                self.pathSetters[path] = setter
+        return setter
+
+    def compileField(self, jfield, mfield, fieldType):
+        if callable(mfield):
+            getPathSetter = self.getPathSetter
+
+            def setByFunction(djangoModel, value):
+                # Function returns (model field, value) to set or None if it has set model itself
+                result = mfield(djangoModel, value)
+                if result is not None and result[1] is not None:
+                    getPathSetter(result[0])(djangoModel, result[1])
+
+            return setByFunction
+        convert = self.converters.get(fieldType, str)
+        if type(mfield) is dict:
+            constant = mfield.get('value', None)
+            setPath = self.compilePath(jfield)
+            if constant is None:
+                return lambda djangoModel, value: None
+            constant = convert(constant)
+            return lambda djangoModel, value: setPath(djangoModel, constant)
+        setPath = self.compilePath(mfield)
+        return lambda djangoModel, value: setPath(djangoModel, convert(value))
+
+    def populate(self, jsonDict, djangoModel):
+        for jfield, setter in self.setters:
+            value = jsonDict.get(jfield, None)
+            if value is not None:
+                setter(djangoModel, value)
+        return djangoModel
+
+
+class JsonEncoder(object):
+    """
+    Encode response data into json bytes with standard json module. Datetime values are written in
+    current timezone with dateTimeFormat, or as ISO 8601 with dateTimeFormat 'iso', date as ISO 8601
+    and Decimal as string to keep precision
+    """
+    DEFAULT_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+    ISO = 'iso'
+    # Between items of a list, streamed lists are same as encoded as a whole
+    separator = b', '
+    # Converter of encoder returned by forResponse, None to build one per encode
+    converter = None
+
+    def __init__(self, dateTimeFormat=DEFAULT_DATETIME_FORMAT):
+        self.dateTimeFormat = dateTimeFormat
+
+    def forResponse(self):
+        """Copy of encoder for one response, converter is built once for all rows and values of it"""
+        encoder = copy.copy(self)
+        encoder.converter = self.getConverter()
+        return encoder
+
+    def encode(self, value):
+        return json.dumps(value, default=self.converter or self.getConverter()).encode('utf-8')
+
+    def getDateTimeFormatter(self):
+        """Return function formatting datetime values with dateTimeFormat, current timezone is looked up once"""
+        dateTimeFormat = self.dateTimeFormat
+        if dateTimeFormat == self.ISO:
+            return datetime.datetime.isoformat
+        tz = timezone.get_current_timezone()
+        default = dateTimeFormat == self.DEFAULT_DATETIME_FORMAT
+
+        def formatDateTime(dt):
+            if dt.tzinfo is not None and dt.tzinfo is not tz:
+                dt = dt.astimezone(tz)
+            if default:
+                return '%04d-%02d-%02d %02d:%02d:%02d' % (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
+            return dt.strftime(dateTimeFormat)
+
+        return formatDateTime
+
+    def getConverter(self):
+        """Return function converting values json can't encode, current timezone is looked up once"""
+        formatDateTime = self.getDateTimeFormatter()
+
+        def convert(value):
+            if isinstance(value, datetime.datetime):
+                return formatDateTime(value)
+            if isinstance(value, (datetime.date, datetime.time)):
+                return value.isoformat()
+            if isinstance(value, decimal.Decimal):
+                return str(value)
+            raise TypeError('Object of type %s is not JSON serializable' % type(value).__name__)
+
+        return convert
+
+    def formatValue(self, value):
+        """Text of single value, e.g. in xml"""
+        if isinstance(value, (datetime.date, datetime.time, decimal.Decimal)):
+            return (self.converter or self.getConverter())(value)
+        return str(value)
+
+
+class OrjsonEncoder(JsonEncoder):
+    """
+    JsonEncoder with orjson, same values and datetime format, but other bytes than json module: compact
+    separators and non ascii characters as utf-8 instead of \\u escapes. Opt in with setJsonEncoder of engine
+    """
+    separator = b','
+
+    def __init__(self, dateTimeFormat=JsonEncoder.DEFAULT_DATETIME_FORMAT):
+        import orjson
+        JsonEncoder.__init__(self, dateTimeFormat)
+        self.orjson = orjson
+
+    def encode(self, value):
+        option = self.orjson.OPT_NON_STR_KEYS
+        if self.dateTimeFormat != self.ISO:
+            # orjson writes datetime as ISO 8601 itself, other formats are converted
+            option |= self.orjson.OPT_PASSTHROUGH_DATETIME
+        return self.orjson.dumps(value, default=self.converter or self.getConverter(), option=option)
+
+
+def createJsonEncoder(dateTimeFormat=JsonEncoder.DEFAULT_DATETIME_FORMAT):
+    """OrjsonEncoder if orjson is installed, otherwise JsonEncoder, e.g. ENGINE.setJsonEncoder(createJsonEncoder())"""
+    try:
+        return OrjsonEncoder(dateTimeFormat)
+    except ImportError:
+        return JsonEncoder(dateTimeFormat)
+
+
+class RowStream(object):
+    """
+    List result converted row by row while response is sent instead of built as a whole,
+    see RESTProcessor.setStreaming
+    """
+
+    def __init__(self, rows, chunkSize=2000, onClose=None):
+        self.rows = rows
+        # Number of rows serialized into one chunk of response
+        self.chunkSize = chunkSize
+        self.onClose = onClose
+
+    def __iter__(self):
+        try:
+            for row in self.rows:
+                yield row
+        finally:
+            if self.onClose:
+                self.onClose()
+
+
+# Content-Encoding -> zlib wbits, gzip container or zlib stream as http deflate
+COMPRESSION_WBITS = {'gzip': 31, 'deflate': 15}
+
+
+def compressBytes(content, encoding, level=6):
+    # Fixed gzip header, same bytes for same content so that cached variants can be compared
+    compressor = zlib.compressobj(level, zlib.DEFLATED, COMPRESSION_WBITS[encoding])
+    return compressor.compress(content) + compressor.flush()
+
+
+def iterCompress(chunks, encoding, level=6):
+    """Compress streamed response, every chunk is flushed so that client gets rows as they are sent"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, COMPRESSION_WBITS[encoding])
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def encodeCursor(fields, values):
+    """Opaque _cursor of a row from its values of cursor fields, see RESTProcessor.getCursorFields"""
+    import base64
+    text = json.dumps([['-' + f if descending else f for f, descending in fields], list(values)],
+                      separators=(',', ':'), default=lambda v: v.isoformat() if hasattr(v, 'isoformat') else str(v))
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodeCursor(cursor, fields):
+    """Values of cursor fields in _cursor, cursor must be created with same order"""
+    import base64
+    try:
+        names, values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+    except Exception:
+        raise ParameterErrorException('Invalid cursor')
+    if names != ['-' + f if descending else f for f, descending in fields] or len(values) != len(fields):
+        raise ParameterErrorException('Cursor does not match order %s' % ','.join(names))
+    if None in values:
+        raise ParameterErrorException('Cursor pagination needs values of %s, null found' % ','.join(names))
+    return values
+
+
+class XmlWriter(object):
+    """
+    Write response data as xml text piece by piece, same document as XmlConvert.json_to_xml with tostring,
+    rows of a list are written as they are produced
+    """
+
+    def __init__(self, formatValue=str):
+        self.formatValue = formatValue
+
+    @staticmethod
+    def escape(text):
+        return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+    def element(self, tag, text):
+        if not text:
+            return '<%s />' % tag
+        return '<%s>%s</%s>' % (tag, self.escape(text), tag)
+
+    def write(self, tag, value, pieces):
+        """Append xml of value with tag to pieces, nested dict and list are written iteratively"""
+        stack = [(tag, value, False)]
+        while stack:
+            tag, value, close = stack.pop()
+            if close:
+                pieces.append('</%s>' % tag)
+                continue
+            if type(value) is dict:
+                children = [(k, v, False) for k, v in value.items()]
+            elif type(value) is list:
+                children = [('item', v if type(v) is dict else self.formatValue(v), False) for v in value]
+            else:
+                pieces.append(self.element(tag, value if type(value) is str else self.formatValue(value)))
+                continue
+            if not children:
+                pieces.append('<%s />' % tag)
+                continue
+            pieces.append('<%s>' % tag)
+            stack.append((tag, None, True))
+            stack.extend(reversed(children))
+        return pieces
+
+    def iterWrite(self, tag, rows, chunkSize=2000):
+        """Yield xml bytes of list with tag, rows are read from iterable as they are written"""
+        pieces = ['<%s>' % tag]
+        count = 0
+        for row in rows:
+            self.write('item', row if type(row) is dict else self.formatValue(row), pieces)
+            count += 1
+            if count % chunkSize == 0:
+                yield self.encode(''.join(pieces))
+                pieces = []
+        if not count:
+            yield self.encode('<%s />' % tag)
+            return
+        pieces.append('</%s>' % tag)
+        yield self.encode(''.join(pieces))
+
+    def tostring(self, tag, value):
+        return self.encode(''.join(self.write(tag, value, [])))
+
+    @staticmethod
+    def encode(text):
+        # As tostring of ElementTree, non ascii characters as character references
+        return text.encode('ascii', 'xmlcharrefreplace')
+
+
+class RowWriter(object):
+    """
+    Write list result in a bulk format piece by piece, rows are read from iterable as they are written.
+    A single record is written as list of one
+    """
+    contentType = None
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+
+    def iterWrite(self, rows, chunkSize=2000):
+        raise NotImplementedException("Not Implemented")
+
+    @staticmethod
+    def records(rows):
+        # Rows of other value than record, e.g. entity set names, as records with column value
+        return (row if type(row) is dict else {'value': row} for row in rows)
+
+    @staticmethod
+    def iterChunks(pieces, chunkSize):
+        """Join pieces of rows into chunks of bytes"""
+        chunk = []
+        for piece in pieces:
+            chunk.append(piece)
+            if len(chunk) >= chunkSize:
+                yield b''.join(chunk)
+                chunk = []
+        if chunk:
+            yield b''.join(chunk)
+
+
+class ColumnarWriter(RowWriter):
+    """Json object with keys once in columns and a value array per row, columns are the keys of first row"""
+    contentType = 'application/vnd.myrest.columnar+json'
+
+    def iterWrite(self, rows, chunkSize=2000):
+        return self.iterChunks(self.iterPieces(rows), chunkSize)
+
+    def iterPieces(self, rows):
+        encode = self.encoder.encode
+        rows = self.records(rows)
+        first = next(rows, None)
+        columns = list(first) if first else []
+        yield b'{"columns":' + encode(columns) + b',"rows":['
+        if first is not None:
+            yield encode([first.get(c, None) for c in columns])
+            for row in rows:
+                yield self.encoder.separator + encode([row.get(c, None) for c in columns])
+        yield b']}'
+
+
+class NdjsonWriter(RowWriter):
+    """Newline delimited json, one row per line"""
+    contentType = 'application/x-ndjson'
+
+    def iterWrite(self, rows, chunkSize=2000):
+        encode = self.encoder.encode
+        return self.iterChunks((encode(row) + b'\n' for row in self.records(rows)), chunkSize)
+
+
+class CsvWriter(RowWriter):
+    """Csv with header of keys of first row, nested values as json text"""
+    contentType = 'text/csv'
+
+    def iterWrite(self, rows, chunkSize=2000):
+        import csv, io
+        rows = self.records(rows)
+        first = next(rows, None)
+        if first is None:
+            return
+        columns = list(first)
+        formatValue = self.encoder.formatValue
+        encode = self.encoder.encode
+
+        def cell(value):
+            if value is None:
+                return ''
+            if type(value) is str:
+                return value
+            if type(value) is dict or type(value) is list:
+                return encode(value).decode('utf-8')
+            return formatValue(value)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        writer.writerow([cell(first.get(c, None)) for c in columns])
+        count = 1
+        for row in rows:
+            writer.writerow([cell(row.get(c, None)) for c in columns])
+            count += 1
+            if count % chunkSize == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
 
 
 class XmlConvert(object):
     @staticmethod
-    def json_to_xml(tag, json):
+    def json_to_xml(tag, json, formatValue=str):
         if type(json) is list:
-            return XmlConvert.array_to_xml(tag, json)
+            return XmlConvert.array_to_xml(tag, json, formatValue)
         elif type(json) is dict:
-            return XmlConvert.dict_to_xml(tag, json)
+            return XmlConvert.dict_to_xml(tag, json, formatValue)
         else:
             return None
 
     @staticmethod
-    def array_to_xml(tag, arr):
+    def array_to_xml(tag, arr, formatValue=str):
+        from xml.etree.ElementTree import Element
         elem = Element(tag)
         for val in arr:
             if type(val) is dict:
-                child = XmlConvert.dict_to_xml('item', val)
+                child = XmlConvert.dict_to_xml('item', val, formatValue)
             else:
                 child = Element('item')
-                child.text = str(val)
+                child.text = formatValue(val)
             elem.append(child)
         return elem
 
     @staticmethod
-    def dict_to_xml(tag, d):
+    def dict_to_xml(tag, d, formatValue=str):
+        from xml.etree.ElementTree import Element
         elem = Element(tag)
         for key, val in d.items():
             child = Element(key)
             if type(val) is dict:
-                elem.append(XmlConvert.dict_to_xml(key, val))
+                elem.append(XmlConvert.dict_to_xml(key, val, formatValue))
             elif type(val) is list:
-                elem.append(XmlConvert.array_to_xml(key, val))
+                elem.append(XmlConvert.array_to_xml(key, val, formatValue))
             else:
-                child.text = str(val)
+                child.text = formatValue(val)
                 elem.append(child)
         return elem
 
     @staticmethod
     def xml_to_dict(xml_text):
+        from xml.etree.ElementTree import fromstring
         root = fromstring(xml_text)
         result = {}
         for item in root:
-            children = item.getchildren()
+            children = list(item)
             if children and children[0].tag == 'item':
                 result[item.tag] = XmlConvert.xml_to_array(children)
             else:
@@ -256,9 +1114,48 @@ class XmlConvert(object):
         result = []
         for child in children:
             if child.tag != 'item':
-                result.append({child.tag: child.text.strip()})
+                result.append({child.tag: (child.text or '').strip()})
             else:
-                result.append(child.text.strip())
+                result.append((child.text or '').strip())
+        return result
+
+    @staticmethod
+    def iterparse_to_dict(source):
+        """
+        Same result as xml_to_dict, parsed incrementally from file like source or bytes,
+        elements are dropped once converted so only one field is kept in memory
+        """
+        from xml.etree.ElementTree import iterparse
+        if type(source) is str:
+            source = source.encode('utf-8')
+        if type(source) is bytes:
+            import io
+            source = io.BytesIO(source)
+        result = {}
+        # Elements of root, current field and current child of field
+        path = []
+        # Items of current field when its first child is item, otherwise None
+        array = None
+        firstChild = False
+        for event, elem in iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if len(path) == 1:
+                    firstChild = True
+                elif len(path) == 2 and firstChild:
+                    firstChild = False
+                    array = [] if elem.tag == 'item' else None
+                path.append(elem)
+                continue
+            path.pop()
+            if len(path) == 2:
+                if array is not None:
+                    text = (elem.text or '').strip()
+                    array.append(text if elem.tag == 'item' else {elem.tag: text})
+                path[1].remove(elem)
+            elif len(path) == 1:
+                result[elem.tag] = array if array is not None else elem.text
+                array = None
+                path[0].remove(elem)
         return result
 
 
@@ -270,6 +1167,19 @@ class RESTEngine(object):
     }
     __metaFiles = None
     __metadataUtil = None
+    # Metadata file list and (loaded file, signature) for reload
+    __loadedMetaFiles = None
+    __loadedMetaFile = None
+    __startLock = threading.Lock()
+    __reloadLock = threading.Lock()
+    # Seconds between checks of metadata file change, None for settings, 0 to disable
+    __metadataAutoReload = None
+    __watcherToken = None
+    __watcherPid = None
+    # Directory of compiled metadata snapshots, None for temp directory, empty to disable
+    __metadataCacheDir = None
+    # Max number of resolved url paths kept in cache
+    __routeCacheSize = 1024
     __logger = None
     __dbLogger = None
     # Default parameter names
@@ -282,24 +1192,64 @@ class RESTEngine(object):
         '_page': '_page',
         '_pnum': '_pnum',
         '_distinct': '_distinct',
-        '_columns': '_columns'
+        '_columns': '_columns',
+        '_reference': '_reference',
+        '_format': '_format',
+        '_cursor': '_cursor'
     }
 
     # Default max return size for all processors
     __maxReturnSize = 5000
+    # Max levels of an _expand path, e.g. items/product is 2, None for no limit
+    __maxExpandDepth = 3
     # Default validate csrf token
     __valCSRFToken = True
     # Empty json result return blank string
     __blankForEmptyJsonResult = False
+    # Encoder of json responses, JsonEncoder with json module if not set, see setJsonEncoder
+    __jsonEncoder = None
+    # Keep datetime values in records instead of formatting them, see setRawDateTime
+    __rawDateTime = False
+    # Cache of results of entities with cacheTTL, LocalResultCache if not set
+    __resultCache = None
+    # Compress responses by Accept-Encoding, see setCompression
+    __compression = False
+    __compressionLevel = 6
+    # Content type -> min body size to compress, None never compress, '*' for other content types
+    __compressionMinSizes = {'*': 1024}
+    # Max number of parsed _query plans kept in cache
+    __queryPlanCacheSize = 512
+    __queryPlanCache = None
+    # Hard limits of _query, requests exceed limits are rejected with 400
+    __queryLimits = {
+        'maxLength': 100000,
+        'maxTerms': 10000,
+        'maxDepth': 100
+    }
 
     CONTENT_TYPE_JSON = 'application/json'
     CONTENT_TYPE_XML = 'application/xml'
     CONTENT_TYPE_TEXT = 'text/html'
     CONTENT_TYPE_ANY = '*/*'
+    # Bulk formats of list results, selected with Accept or _format
+    ROW_WRITERS = {
+        ColumnarWriter.contentType: ColumnarWriter,
+        NdjsonWriter.contentType: NdjsonWriter,
+        CsvWriter.contentType: CsvWriter
+    }
+    # _format parameter -> content type
+    FORMATS = {
+        'json': CONTENT_TYPE_JSON,
+        'xml': CONTENT_TYPE_XML,
+        'columnar': ColumnarWriter.contentType,
+        'ndjson': NdjsonWriter.contentType,
+        'csv': CsvWriter.contentType
+    }
     DEFAULT_CONTENT_TYPE = CONTENT_TYPE_JSON
 
     def __init__(self):
-        pass
+        # Metadata snapshot pinned by the request in progress of each thread
+        self.__local = threading.local()
 
     def setLogger(self, logger):
         self.__logger = logger
@@ -336,12 +1286,99 @@ class RESTEngine(object):
     def setValCSRFToken(self, valToken):
         self.__valCSRFToken = valToken
 
+    def setMaxExpandDepth(self, depth):
+        self.__maxExpandDepth = depth
+
+    def getMaxExpandDepth(self):
+        return self.__maxExpandDepth
+
     def setBlankForEmptyJsonResult(self, blank):
         self.__blankForEmptyJsonResult = blank
 
     def getBlankForEmptyJsonResult(self):
         return self.__blankForEmptyJsonResult
 
+    def setJsonEncoder(self, encoder):
+        """Encoder of json responses, JsonEncoder or subclass, e.g. OrjsonEncoder() for faster, compact output"""
+        self.__jsonEncoder = encoder
+
+    def getJsonEncoder(self):
+        if self.__jsonEncoder is None:
+            self.__jsonEncoder = JsonEncoder(
+                getattr(settings, 'MYREST_DATETIME_FORMAT', JsonEncoder.DEFAULT_DATETIME_FORMAT))
+        return self.__jsonEncoder
+
+    def setResultCache(self, resultCache):
+        """ResultCache of list and single results, LocalResultCache() or DjangoResultCache('default') to share by workers"""
+        self.__resultCache = resultCache
+
+    def getResultCache(self):
+        if self.__resultCache is None:
+            self.__resultCache = LocalResultCache()
+        return self.__resultCache
+
+    def setDateTimeFormat(self, dateTimeFormat):
+        """strftime format of datetime values in responses, 'iso' for ISO 8601"""
+        self.getJsonEncoder().dateTimeFormat = dateTimeFormat
+
+    def setRawDateTime(self, raw):
+        """
+        True to keep datetime values in records of convertData, e.g. given to afterGetList, customizedListResponse
+        and postProcessResult, they are formatted when response is encoded. False(default) formats them in records
+        """
+        self.__rawDateTime = raw
+
+    def getRawDateTime(self):
+        return self.__rawDateTime
+
+    def getDateTimeFormatter(self):
+        """Function formatting datetime values of records, None if they are kept"""
+        if self.__rawDateTime:
+            return None
+        return self.getJsonEncoder().getDateTimeFormatter()
+
+    def setCompression(self, compress, level=6, minSizes=None):
+        """
+        Compress responses with gzip or deflate when client accepts it, level 1 fastest to 9 smallest,
+        minSizes content type -> min body size, e.g. {'text/csv': 256, 'application/xml': None}.
+        _metadata and entity list responses keep their compressed variants with the metadata
+        """
+        self.__compression = compress
+        self.__compressionLevel = level
+        if minSizes is not None:
+            compressionMinSizes = dict(self.__compressionMinSizes)
+            compressionMinSizes.update(minSizes)
+            self.__compressionMinSizes = compressionMinSizes
+
+    def getCompressionLevel(self):
+        return self.__compressionLevel
+
+    def setQueryPlanCacheSize(self, size):
+        self.__queryPlanCacheSize = size
+        self.__queryPlanCache = None
+
+    def setQueryLimits(self, limits):
+        """Update _query limits, keys are maxLength, maxTerms and maxDepth, None for no limit"""
+        queryLimits = dict(self.__queryLimits)
+        queryLimits.update(limits)
+        self.__queryLimits = queryLimits
+        self.__queryPlanCache = None
+
+    def getQueryLimits(self):
+        return self.__queryLimits
+
+    def getQueryPlan(self, text):
+        """Return (plan, values) of a _query text, plan is shared by queries differ only in values"""
+        if self.__queryPlanCache is None:
+            self.__queryPlanCache = QueryPlanCache(self.__queryPlanCacheSize, self.__queryLimits)
+        return self.__queryPlanCache.getPlan(text)
+
+    def getQueryPlanCacheStats(self):
+        if self.__queryPlanCache is None:
+            return {'size': 0, 'maxSize': self.__queryPlanCacheSize, 'hits': 0, 'misses': 0, 'evictions': 0,
+                    'textHits': 0, 'textMisses': 0}
+        return self.__queryPlanCache.stats()
+
     def registerProcessor(self, entityName, processor):
         processor.setEngine(self)
         processor.bindEntityName(entityName)
@@ -356,7 +1393,7 @@ class RESTEngine(object):
         return processor
 
     def getProcessorByEntitySetName(self, entitySetName):
-        entityName = self.__metadataUtil.metadata['sets'].get(entitySetName, None)
+        entityName = self.getMetadataUtil().metadata['sets'].get(entitySetName, None)
         if not entityName:
             raise InternalException('No sets defined for %s' % entitySetName)
         return self.getProcessor(entityName)
@@ -378,48 +1415,219 @@ class RESTEngine(object):
     def loadMetadata(self, yamlFile):
         if not yamlFile:
             raise InternalException('No metadata file')
-        self.__metadataUtil = MetadataUtil(yamlFile)
+        metadataUtil = MetadataUtil(yamlFile)
+        metadataUtil.routeTable = RouteTable(metadataUtil, self.__routeCacheSize)
+        # Swapped with a single assignment, requests in progress keep the snapshot they pinned
+        self.__metadataUtil = metadataUtil
+        self.__queryPlanCache = None
+
+    def setRouteCacheSize(self, size):
+        self.__routeCacheSize = size
+        metadataUtil = self.__metadataUtil
+        if metadataUtil is not None:
+            metadataUtil.routeTable = RouteTable(metadataUtil, size)
+
+    def getRouteCacheStats(self):
+        if self.__metadataUtil is None:
+            return {'size': 0, 'maxSize': self.__routeCacheSize, 'hits': 0, 'misses': 0, 'evictions': 0}
+        return self.__metadataUtil.routeTable.cache.stats()
 
     def loadMetadataFromList(self, yamlFileList):
         for yamlFile in yamlFileList:
             try:
-                self.loadMetadata(open(yamlFile))
+                signature = self.__fileSignature(yamlFile)
+                self.loadMetadata(self.readMetadataFile(yamlFile))
+                self.__loadedMetaFiles = yamlFileList
+                self.__loadedMetaFile = (yamlFile, signature)
                 break
             except Exception as e:
                 raise InternalException('Failed to load yaml meta file: %s' % str(e))
 
+    def reloadMetadata(self):
+        """
+        Load metadata files again and swap in new metadata, requests in progress finish with the old one.
+        Current metadata is kept if loading fails, return True if reloaded
+        """
+        if self.__loadedMetaFiles is None:
+            return False
+        with self.__reloadLock:
+            try:
+                self.loadMetadataFromList(self.__loadedMetaFiles)
+            except Exception as e:
+                self.logError('[RESTEngine][reloadMetadata] keep current metadata: %s' % str(e))
+                return False
+        self.logInfo('[RESTEngine][reloadMetadata] metadata reloaded from %s' % self.__loadedMetaFile[0])
+        return True
+
+    def reloadMetadataIfChanged(self):
+        loaded = self.__loadedMetaFile
+        if loaded is None:
+            return False
+        try:
+            if self.__fileSignature(loaded[0]) == loaded[1]:
+                return False
+        except OSError as e:
+            self.logError('[RESTEngine][reloadMetadataIfChanged] %s' % str(e))
+            return False
+        return self.reloadMetadata()
+
+    def setMetadataAutoReload(self, interval):
+        """Check metadata file change every interval seconds in a background thread, 0 to disable"""
+        self.__metadataAutoReload = interval
+        self.__watcherToken = None
+        self.__watcherPid = None
+
+    def __getMetadataAutoReload(self):
+        interval = self.__metadataAutoReload
+        if interval is None:
+            interval = getattr(settings, 'MYREST_METADATA_AUTO_RELOAD', 0)
+        return interval
+
+    def __startWatcher(self):
+        with self.__startLock:
+            if self.__watcherPid == os.getpid():
+                return
+            # Thread exits once token is replaced, a forked worker starts its own
+            token = object()
+            self.__watcherToken = token
+            self.__watcherPid = os.getpid()
+            threading.Thread(target=self.__watchMetadata, args=(token,), name='myrest-metadata-watcher',
+                             daemon=True).start()
+
+    def __watchMetadata(self, token):
+        while True:
+            interval = self.__getMetadataAutoReload()
+            if not interval:
+                break
+            time.sleep(interval)
+            if self.__watcherToken is not token:
+                break
+            try:
+                self.reloadMetadataIfChanged()
+            except Exception as e:
+                self.logError('[RESTEngine][watchMetadata] %s' % str(e))
+
+    @staticmethod
+    def __fileSignature(yamlFile):
+        stat = os.stat(yamlFile)
+        return (os.path.abspath(yamlFile), stat.st_mtime_ns, stat.st_size, VERSION)
+
+    def setMetadataCacheDir(self, path):
+        """Directory for compiled metadata snapshots, None for default temp directory, empty string to disable"""
+        self.__metadataCacheDir = path
+
+    def __getSnapshotFile(self, yamlFile):
+        cacheDir = self.__metadataCacheDir
+        if cacheDir is None:
+            cacheDir = getattr(settings, 'MYREST_METADATA_CACHE_DIR', None)
+        if cacheDir is None:
+            import tempfile
+            cacheDir = os.path.join(tempfile.gettempdir(), 'myrest-%s' % (os.getuid() if hasattr(os, 'getuid') else ''))
+        if not cacheDir:
+            return None
+        name = hashlib.md5(os.path.abspath(yamlFile).encode('utf-8')).hexdigest()
+        return os.path.join(cacheDir, '%s.metadata' % name)
+
+    def __isPrivateDir(self, path):
+        # Snapshot is only trusted in a directory nobody else can write to
+        try:
+            os.makedirs(path, mode=0o700, exist_ok=True)
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if hasattr(os, 'getuid') and stat.st_uid != os.getuid():
+            return False
+        return not stat.st_mode & 0o022
+
+    def readMetadataFile(self, yamlFile):
+        """
+        Return parsed metadata of yaml file, a marshal snapshot is kept in metadata cache dir and
+        reused as long as path, modification time and size of the file are not changed
+        """
+        import marshal
+        signature = self.__fileSignature(yamlFile)
+        snapshotFile = self.__getSnapshotFile(yamlFile)
+        if snapshotFile and not self.__isPrivateDir(os.path.dirname(snapshotFile)):
+            snapshotFile = None
+        if snapshotFile:
+            try:
+                with open(snapshotFile, 'rb') as f:
+                    snapshotSignature, metadata = marshal.load(f)
+                if tuple(snapshotSignature) == signature:
+                    return metadata
+            except (OSError, EOFError, ValueError, TypeError):
+                pass
+        with open(yamlFile, 'rb') as f:
+            metadata = loadYaml(f)
+        if snapshotFile:
+            try:
+                tmpFile = '%s.%d.tmp' % (snapshotFile, os.getpid())
+                with open(tmpFile, 'wb') as f:
+                    marshal.dump((signature, metadata), f)
+                os.replace(tmpFile, snapshotFile)
+            except (OSError, ValueError) as e:
+                # Not writable or metadata contains types marshal can't keep, e.g. date
+                self.logDebug('[RESTEngine] metadata snapshot not written: %s' % str(e))
+        return metadata
+
     def start(self, metaFiles=None):
         try:
             if metaFiles is None:
                 if hasattr(settings, 'MYREST_API_METADATA'):
                     metaFiles = settings.MYREST_API_METADATA
-                    ENGINE.loadMetadataFromList(metaFiles)
+                    self.loadMetadataFromList(metaFiles)
                     self.logDebug(
                         '[RESTEngine][start] started with MYREST_API_METADATA in settings')
                 else:
                     self.logDebug(
                         '[RESTEngine][start] No metafile path given and no MYREST_API_METADATA found in settings')
             else:
-                ENGINE.loadMetadataFromList(metaFiles)
+                self.loadMetadataFromList(metaFiles)
                 self.logDebug(
                     '[RESTEngine][start] started with given paths %s' % metaFiles)
         except Exception as e:
             raise InternalException('[myrestengine] loadmetadata failed: %s' % str(e))
 
+    def __ensureStarted(self):
+        # Lazy start with settings on first use
+        if self.__metadataUtil is None:
+            with self.__startLock:
+                if self.__metadataUtil is None:
+                    self.start()
+        if self.__watcherPid != os.getpid() and self.__getMetadataAutoReload():
+            self.__startWatcher()
+
+    def preload(self):
+        """
+        Build all compiled state up front, call before workers are forked(e.g. gunicorn preload_app),
+        so workers share it copy-on-write instead of building it on first request each
+        """
+        # Modules otherwise imported on first use
+        import gc, pickle, random, base64, xml.etree.ElementTree
+        self.__ensureStarted()
+        # Keep loaded objects out of garbage collection, collecting would touch and copy their pages
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
     def getMetadataUtil(self):
+        metadataUtil = getattr(self.__local, 'metadataUtil', None)
+        if metadataUtil is not None:
+            return metadataUtil
+        self.__ensureStarted()
         if self.__metadataUtil is None:
             raise InternalException('[myrestengine] metadata is None, check load filepath')
         return self.__metadataUtil
 
     def getKeysFromRecord(self, entityName, resultRecord):
-        self.__metadataUtil.getKeyFieldDef(entityName)
         expandKeys = {}
-        for k in self.__metadataUtil.getKeyFieldDef(entityName):
-            expandKeys[k['name']] = resultRecord[k['name']]
+        for k in self.getMetadataUtil().getEntitySchema(entityName).keyNames:
+            expandKeys[k] = resultRecord[k]
         expandKeys = {entityName: expandKeys}
         return expandKeys
 
     def __getRandomToken(self):
+        import random
         token = '%d%d' % (int(time.time()), random.randint(0, 999),)
         return token
 
@@ -427,18 +1635,21 @@ class RESTEngine(object):
     def getUserContext(request):
         userContextData = request.session.get('myRestContext', None)
         if userContextData:
+            import pickle
             return pickle.loads(userContextData)
         else:
             return None
 
     @staticmethod
     def setUserContext(request, userContext):
+        import pickle
         userContextData = pickle.dumps(userContext)
         request.session['myRestContext'] = userContextData
 
     def __checkAndGenerateCsrfToken(self, request, header):
         csrfToken = request.META.get('HTTP_CSRF_TOKEN', None)
         if csrfToken == 'Fetch':
+            import base64
             token = self.__getRandomToken()
             tokenBytes = token.encode('utf-8')
             result = base64.encodebytes(tokenBytes)
@@ -463,71 +1674,193 @@ class RESTEngine(object):
         self.logDebug("csrf-token is expired")
         return False
 
-    def __validatePath(self, pathArray):
-        tmpArray = pathArray[:-1]
-        if len(pathArray) > 1:
-            depth = len(pathArray) - 1
-            for i in range(depth):
-                parentPath, subPath = pathArray[i], pathArray[i + 1]
-                subEntityInfo, parentEntityInfo = self.__getEntityInfo(subPath), self.__getEntityInfo(parentPath)
-                print(subEntityInfo)
-                print(parentEntityInfo)
-                parentEntityName = parentEntityInfo['entityName']
-                parentEntityKey = parentEntityInfo['keys']
-                subEntityName = subEntityInfo['entityName']
-                possibleExpandItems = self.__metadataUtil.getExpandFieldDef(parentEntityName)
-                if subPath not in possibleExpandItems:
-                    raise InternalException('Navigation %s is not valid from parent %s' % (subPath, parentEntityName))
-                if not parentEntityKey:
-                    # Parent entity must contain keys for cascade relationship
-                    raise InternalException('Keys must be provided for %s' % parentEntityName)
-
-        parentEntityName = None
-        for path in tmpArray:
-            entityInfo = self.__getEntityInfo(path)
-            entityName = entityInfo['entityName']
-            keys = entityInfo['keys']
-            if not keys:
-                # Parent entity must contain keys for cascade relationship
-                raise InternalException('Keys must be provided for %s' % entityInfo['entityName'])
-            if parentEntityName:
-                possibleExpandItems = self.__metadataUtil.getExpandFieldDef(parentEntityName)
-                if path not in possibleExpandItems:
-                    raise InternalException('Navigation %s is not valid from %s' % (path, parentEntityName))
-            parentEntityName = entityName
-
-    def __process(self, request, pathArray, params):
+    def __process(self, request, path, params):
         allKeys = {}
-        result = None
-        self.__validatePath(pathArray)
-        for entityPath in pathArray:
-            # Get information, type values: list or single
-            entityInfo = self.__getEntityInfo(entityPath)
+        # Get information of each entity in path, type values: list or single
+        entityInfos = self.getMetadataUtil().routeTable.resolve(path)
+        for entityInfo in entityInfos:
             allKeys.update(entityInfo['keys'])
-            if entityPath == pathArray[-1]:
-                # Only process last entity with all keys from previous entities
-                processor = self.getProcessor(entityInfo['entityName'])
-                if not processor:
-                    raise InternalException('No processor found for %s ' % entityInfo['entityName'])
-                result = processor.handle_http_request(request, params, allKeys, entityInfo)
-        return result
+        # Only process last entity with all keys from previous entities
+        entityInfo = entityInfos[-1]
+        processor = self.getProcessor(entityInfo['entityName'])
+        return processor.handle_http_request(request, params, allKeys, entityInfo)
 
     def __convertResponse(self, result, content_types):
+        writerClass = self.__getRowWriterClass(content_types)
+        if writerClass is not None:
+            if isinstance(result, RowStream) or type(result) in (list, dict):
+                return self.__writeRowsResponse(writerClass(self.getJsonEncoder().forResponse()), result)
+            # Not rows, e.g. _count
+            content_types = [self.DEFAULT_CONTENT_TYPE]
+        if isinstance(result, RowStream):
+            if self.DEFAULT_CONTENT_TYPE in content_types or self.CONTENT_TYPE_TEXT in content_types or \
+                    self.CONTENT_TYPE_ANY in content_types:
+                return self.__streamJsonResponse(result)
+            elif self.CONTENT_TYPE_XML in content_types:
+                return self.__streamXmlResponse(result)
+            result = list(result)
         response = HttpResponse()
         if self.DEFAULT_CONTENT_TYPE in content_types or self.CONTENT_TYPE_TEXT in content_types or self.CONTENT_TYPE_ANY in content_types:
             if self.__blankForEmptyJsonResult:
-                response.content = json.dumps(result) if result else ''
+                response.content = self.getJsonEncoder().encode(result) if result else ''
             else:
-                response.content = json.dumps(result)
+                response.content = self.getJsonEncoder().encode(result)
             response['Content-Type'] = self.DEFAULT_CONTENT_TYPE
         elif self.CONTENT_TYPE_XML in content_types:
-            response.content = tostring(XmlConvert.json_to_xml('xml', result)) if result else ''
+            response.content = XmlWriter(self.getJsonEncoder().forResponse().formatValue).tostring('xml', result) \
+                if result else ''
             response['Content-Type'] = self.CONTENT_TYPE_XML
         else:
             response.content = 'Required content type %s not supported' % content_types
             response['Content-Type'] = self.CONTENT_TYPE_TEXT
         return response
 
+    def __getRowWriterClass(self, content_types):
+        for contentType in content_types:
+            writerClass = self.ROW_WRITERS.get(contentType.split(';')[0].strip(), None)
+            if writerClass is not None:
+                return writerClass
+        return None
+
+    def __writeRowsResponse(self, writer, result):
+        if isinstance(result, RowStream):
+            rows = iter(result)
+            # Query runs here, errors are still returned as error response before anything is sent
+            first = next(rows, None)
+            rows = itertools.chain((first,), rows) if first is not None else ()
+            response = StreamingHttpResponse(writer.iterWrite(rows, result.chunkSize))
+        else:
+            response = HttpResponse(b''.join(writer.iterWrite([result] if type(result) is dict else result)))
+        response['Content-Type'] = writer.contentType
+        return response
+
+    def __streamJsonResponse(self, rowStream):
+        rows = iter(rowStream)
+        # Query runs here, errors are still returned as error response before anything is sent
+        first = next(rows, None)
+
+        encoder = self.getJsonEncoder().forResponse()
+
+        def generate():
+            if first is None:
+                yield b'' if self.__blankForEmptyJsonResult else b'[]'
+                return
+            chunk = [b'[', encoder.encode(first)]
+            for row in rows:
+                chunk.append(encoder.separator)
+                chunk.append(encoder.encode(row))
+                if len(chunk) >= rowStream.chunkSize * 2:
+                    yield b''.join(chunk)
+                    chunk = []
+            chunk.append(b']')
+            yield b''.join(chunk)
+
+        response = StreamingHttpResponse(generate())
+        response['Content-Type'] = self.DEFAULT_CONTENT_TYPE
+        return response
+
+    def __streamXmlResponse(self, rowStream):
+        rows = iter(rowStream)
+        # Query runs here, errors are still returned as error response before anything is sent
+        first = next(rows, None)
+        if first is None:
+            content = []
+        else:
+            content = XmlWriter(self.getJsonEncoder().forResponse().formatValue).iterWrite(
+                'xml', itertools.chain((first,), rows), rowStream.chunkSize)
+        response = StreamingHttpResponse(content)
+        response['Content-Type'] = self.CONTENT_TYPE_XML
+        return response
+
+    def __convertMetadataResponse(self, request, path, content_types):
+        # Serialized once per metadata snapshot and content type, dropped with the snapshot on reload
+        metadataUtil = self.getMetadataUtil()
+        cacheKey = (path, tuple(content_types))
+        cached = metadataUtil.responseCache.get(cacheKey, None)
+        if cached is None:
+            if path == '_metadata':
+                result = metadataUtil.metadata
+            else:
+                result = [k for k in metadataUtil.metadata.get('sets', None)]
+            response = self.__convertResponse(result, content_types)
+            content = response.content
+            # Strong validator from content, same in every worker and across restarts
+            etag = '"%s"' % hashlib.sha1(content).hexdigest()
+            cached = {'content': content, 'contentType': response['Content-Type'], 'etag': etag}
+            if len(metadataUtil.responseCache) < 64:
+                metadataUtil.responseCache[cacheKey] = cached
+        compress = self.__isCompressible(cached['contentType'], len(cached['content']))
+        encoding = self.__acceptedEncoding(request) if compress else None
+        etag = cached['etag'] if encoding is None else '"%s-%s"' % (cached['etag'][1:-1], encoding)
+        ifNoneMatch = request.META.get('HTTP_IF_NONE_MATCH', None)
+        # Weak comparison as for any If-None-Match
+        if ifNoneMatch and (ifNoneMatch.strip() == '*' or
+                            etag in [e[2:] if e.startswith('W/') else e for e in parse_etags(ifNoneMatch)]):
+            response = HttpResponseNotModified()
+        elif encoding is not None:
+            # Compressed once per variant, kept with the snapshot as the plain body
+            level = self.__compressionLevel
+            content = cached.get((encoding, level), None)
+            if content is None:
+                content = cached[(encoding, level)] = compressBytes(cached['content'], encoding, level)
+            response = HttpResponse(content)
+            response['Content-Encoding'] = encoding
+        else:
+            response = HttpResponse(cached['content'])
+        response['Content-Type'] = cached['contentType']
+        response['ETag'] = etag
+        if compress:
+            response['Vary'] = 'Accept-Encoding'
+        return response
+
+    @staticmethod
+    def __acceptedEncoding(request):
+        """Preferred of gzip and deflate by Accept-Encoding q values, None if neither accepted"""
+        qualities = {}
+        for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+            parts = coding.strip().split(';')
+            quality = 1.0
+            for param in parts[1:]:
+                name, _, value = param.partition('=')
+                if name.strip() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            qualities[parts[0].strip().lower()] = quality
+        best = None
+        for encoding in COMPRESSION_WBITS:
+            quality = qualities.get(encoding, qualities.get('*', 0.0))
+            if quality > 0 and (best is None or quality > qualities.get(best, qualities.get('*', 0.0))):
+                best = encoding
+        return best
+
+    def __isCompressible(self, contentType, size):
+        """If body of content type and size, None if unknown, is compressed by setCompression"""
+        if not self.__compression:
+            return False
+        contentType = contentType.split(';')[0].strip()
+        minSize = self.__compressionMinSizes.get(contentType, self.__compressionMinSizes.get('*', None))
+        # Size of streamed response is unknown, it is compressed whenever its content type is
+        return minSize is not None and (size is None or size >= minSize)
+
+    def __compressResponse(self, request, response):
+        if response.has_header('Content-Encoding') or response.status_code in (204, 304):
+            return response
+        if not self.__isCompressible(response.get('Content-Type', ''),
+                                     None if response.streaming else len(response.content)):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.__acceptedEncoding(request)
+        if encoding is None:
+            return response
+        if response.streaming:
+            response.streaming_content = iterCompress(response.streaming_content, encoding, self.__compressionLevel)
+        else:
+            response.content = compressBytes(response.content, encoding, self.__compressionLevel)
+        response['Content-Encoding'] = encoding
+        return response
+
     def __checkMethodHttpContentTypeAndAccept(self, method, content_types, accepts):
         if method not in ['HEAD', 'GET', 'POST', 'PUT', 'DELETE']:
             raise ParameterErrorException('method %s not allow' % method)
@@ -556,124 +1889,47 @@ class RESTEngine(object):
             'count': count,
             'method': request.method,
             "reference": request.GET.get(self.__parameterNames['_reference'], None),
+            'cursor': request.GET.get(self.__parameterNames['_cursor'], None),
         }
         return params
 
-    def __checkKeyPattern(self, keysArray):
-        if self.__checkArrayPattern(keysArray, lambda key: len(key.split('=')) == 2):
-            return 1
-        elif self.__checkArrayPattern(keysArray, lambda key: len(key.split('=')) == 1):
-            return 2
-        else:
-            raise ParameterErrorException("Either use key=value or 'value', but not mixed")
-
-    def __checkArrayPattern(self, pArray, pFunc):
-        return reduce(lambda x, y: x << 1 | y, list(map(lambda x: pFunc(x), pArray))) == 2 ** len(pArray) - 1
-
-    def __getEntityInfo(self, urlPath):
-        regItem = re.match(r'(\w*)(\(.*\))?', urlPath)
-        if not regItem:
-            raise ParameterErrorException('Wrong Url pattern')
-        entitySet = regItem.group(1)
-        if not entitySet:
-            raise ParameterErrorException('No entity set name found')
-        entityName = self.__metadataUtil.metadata['sets'].get(entitySet, None)
-        if not entityName:
-            raise ParameterErrorException('Invalid entity name')
-        entityDef = self.__metadataUtil.metadata.get(entityName, None)
-        if not entityDef:
-            raise ParameterErrorException('Entity metadata not found')
-        keys = {}
-        if regItem.group(2):
-            keysString = regItem.group(2)[1:-1]
-            keysArray = keysString.split(',')
-            keyDefs = self.__metadataUtil.getKeyFieldDef(entityName)
-            if len(keysArray) != len(keyDefs):
-                raise ParameterErrorException('key fields length mismatch')
-            if len(keysArray) == 1:
-                if len(keyDefs) != 1:
-                    raise ParameterErrorException('Number of key field mismatch')
-                value = self.__metadataUtil.checkFieldValueByType(keysArray[0], keyDefs[0]['type'])
-                if not value:
-                    raise ParameterErrorException('Wrong key value %s' % value)
-                keys[entityName] = {keyDefs[0]['name']: value}
-            else:
-                keyPairs = {}
-                # Validate key pairs pattern
-                # Pattern 1 entity(key1='value', key2='value2')
-                # Pattern 2 entity('value','value2)
-                pattern = self.__checkKeyPattern(keysArray)
-                if pattern == 1:
-
-                    def mapKey(x):
-                        keyPair = x.split('=')
-                        key, value = keyPair[0].strip(), keyPair[1].strip()
-                        keyDef = self.__metadataUtil.getKeyFieldDef(entityName, key)
-                        if not keyDef:
-                            raise ParameterErrorException('Wrong key %s' % key)
-                        value = self.__metadataUtil.checkFieldValueByType(value, keyDef['type'])
-                        if not value:
-                            raise ParameterErrorException('Wrong key value %s' % value)
-                        return {keyDef['name']: value}
-
-                    keyPairs = reduce(lambda x, y: x.update(y) or x, list(map(mapKey, keysArray)))
-                elif pattern == 2:
-
-                    def mapKey(x, y):
-                        x = x.strip()
-                        x = self.__metadataUtil.checkFieldValueByType(x, y['type'])
-                        if not x:
-                            raise ParameterErrorException('Wrong key value')
-                        return {y['name']: x}
-
-                    keyPairs = reduce(lambda x, y: x.update(y) or x, list(map(mapKey, keysArray, keyDefs)))
-
-                keys[entityName] = keyPairs
-            queryType = "single"
-        else:
-            queryType = "list"
-        return {
-            'entitySet': entitySet,
-            'entityName': entityName,
-            'queryType': queryType,
-            'keys': keys
-        }
-
     def __handle(self, request, path):
+        self.__ensureStarted()
         # Create default user context if not available
         userContext = self.getUserContext(request)
         if not userContext:
             userContext = UserContext()
             self.setUserContext(request, userContext)
-        # Split request entities
-        pathArray = path.split('/')
         # Default http status
         http_response_status = 404
         # Response header
         http_response_header = {}
         requestContentTypes = request.META.get('CONTENT_TYPE', RESTEngine.DEFAULT_CONTENT_TYPE).split(',')
         requiredContentTypes = request.META.get('HTTP_ACCEPT', RESTEngine.DEFAULT_CONTENT_TYPE).split(',')
-        if path == '' or path is None:
-            availableEntities = []
-            for k, v in self.getMetadataUtil().metadata.get('sets', None).items():
-                availableEntities.append(k)
-            response = self.__convertResponse(availableEntities, requiredContentTypes)
-            return response
-        elif path == '_metadata':
-            response = self.__convertResponse(self.getMetadataUtil().metadata, requiredContentTypes)
-            return response
+        responseFormat = request.GET.get(self.__parameterNames['_format'], None)
+        if responseFormat:
+            # Response format in url overrides Accept, e.g. for links opened in browser
+            if responseFormat not in self.FORMATS:
+                raise ParameterErrorException('Format %s not supported, use one of %s' % (
+                    responseFormat, ', '.join(self.FORMATS)))
+            requiredContentTypes = [self.FORMATS[responseFormat]]
+        if path == '' or path is None or path == '_metadata':
+            return self.__convertMetadataResponse(request, path or '', requiredContentTypes)
         method = request.method
         self.__checkMethodHttpContentTypeAndAccept(method, requestContentTypes, requiredContentTypes)
         if method == 'GET' or method == 'HEAD':
             params = self.__convertGETparameter(request) if method == 'GET' else {}
+            if params.get('cursor', None) is not None and self.__getRowWriterClass(requiredContentTypes):
+                # Page of cursor pagination is rows with next cursor, not rows only
+                raise ParameterErrorException('_cursor is not supported with format %s' % requiredContentTypes[0])
             self.__checkAndGenerateCsrfToken(request, http_response_header)
-            result = self.__process(request, pathArray, params)
+            result = self.__process(request, path, params)
             http_response_status = 200
         else:
             # For POST PUT DELETE
             if self.__valCSRFToken and not self.__validateCsrfToken(request):
                 raise NoAuthException('csrf token error')
-            result = self.__process(request, pathArray, None)
+            result = self.__process(request, path, None)
             if method == 'POST':
                 http_response_status = 201
             else:
@@ -683,14 +1939,19 @@ class RESTEngine(object):
         for k, v in http_response_header.items():
             response[k] = v
         self.manipulateResponseHeader(response)
-        return response
+        return self.__compressResponse(request, response)
 
     def handle(self, request, path):
+        pinned = getattr(self.__local, 'metadataUtil', None)
         try:
+            # Whole request sees one metadata snapshot even if metadata is reloaded meanwhile
+            self.__local.metadataUtil = self.getMetadataUtil()
             return self.__handle(request, path)
         except Exception as e:
             response = HttpResponseBadRequest(str(e))
             return response
+        finally:
+            self.__local.metadataUtil = pinned
 
 
 class RESTProcessor(object):
@@ -698,6 +1959,22 @@ class RESTProcessor(object):
     __baseDjangoModel = None
     __bindEntityName = None
     __maxReturnSize = None
+    # Read lists with values_list, None for simple mappings unless convertData or afterGetList is overwritten
+    __valuesList = None
+    # Rows per chunk of streamed list response, None to follow streaming of entity in metadata
+    __streamingChunkSize = None
+    # forReference -> RowSerializer
+    __rowSerializers = {}
+    # usage -> ModelPopulator
+    __modelPopulators = {}
+    # Total of paged lists and _count, see setCountMode, None is count query without count in kwargs
+    __countMode = None
+    __countEstimateThreshold = 1000000
+    # Totals cached per filter, see setCountCacheTTL
+    __countCacheTTL = None
+    __countCache = None
+    # Datetime formatter of the list converted by iterConvertData, read by convertData of each row
+    __conversion = threading.local()
 
     def __init__(self, baseDjangoModel):
         self.__baseDjangoModel = baseDjangoModel
@@ -720,6 +1997,19 @@ class RESTProcessor(object):
     def getMaxReturnSize(self):
         return self.__maxReturnSize
 
+    def setStreaming(self, chunkSize=2000):
+        """Stream list responses, chunkSize rows are read and sent at a time, 0 to disable, None for metadata"""
+        self.__streamingChunkSize = chunkSize
+
+    def getStreamingChunkSize(self):
+        chunkSize = self.__streamingChunkSize
+        if chunkSize is None:
+            schema = self.__engine.getMetadataUtil().getEntitySchema(self.getBindEntityName())
+            chunkSize = schema.streaming if schema else False
+            if chunkSize is True:
+                chunkSize = 2000
+        return chunkSize or None
+
     def __getSelfKey(self, keys):
         key = keys.get(self.__bindEntityName, None)
         if not key:
@@ -732,11 +2022,24 @@ class RESTProcessor(object):
     def __getSelfKeyValue(self, keys, column):
         return self.__getSelfKey(keys).get(column, None)
 
-    def __validateExpandItem(self, entityName, expandItemList):
+    def __getExpandTree(self, entityName, expandItemList):
+        """Expand items as tree of names, path items/product is {'items': {'product': {}}}, validated against metadata"""
+        metadataUtil = self.__engine.getMetadataUtil()
+        maxDepth = self.__engine.getMaxExpandDepth()
+        expandTree = {}
         for expandItem in expandItemList:
-            if expandItem not in self.__engine.getMetadataUtil().getExpandFieldDef(entityName):
-                raise ParameterErrorException('Expand item %s not valid' % expandItem)
-        return True
+            names = expandItem.split('/')
+            if maxDepth and len(names) > maxDepth:
+                raise ParameterErrorException('Expand item %s exceeds max depth %d' % (expandItem, maxDepth))
+            node = expandTree
+            itemEntityName = entityName
+            for name in names:
+                schema = metadataUtil.getEntitySchema(itemEntityName)
+                if schema is None or name not in schema.expandMap:
+                    raise ParameterErrorException('Expand item %s not valid' % expandItem)
+                itemEntityName = metadataUtil.getEntityNameOfType(schema.expandMap[name])
+                node = node.setdefault(name, {})
+        return expandTree
 
     def __expandItemProcess(self, request, expandItem, expandItemSet, parentItemkeys):
         processor = self.__engine.getProcessorByUrlName(expandItemSet)
@@ -744,64 +2047,84 @@ class RESTProcessor(object):
         result = processor.handle_http_request(request, {'expandName': expandItem}, parentItemkeys, {'queryType': qt})
         return result
 
-    def __formatDateTime(self, dt, format="%Y-%m-%d %H:%M:%S"):
-        return str(timezone.localtime(dt).strftime(format))
-
-    def __populateToJson(self, jsonDict, djangoModel, fields, reqFields=None):
-        onlyReturnReqFeilds = reqFields is not None and len(reqFields) > 0
-        for field in fields:
-            if type(field) is tuple:
-                jfield, mfield = field[0], field[1]
-            else:
-                mfield = jfield = field
-            if callable(mfield):
-                value = mfield(djangoModel)
-            elif type(mfield) is dict:
-                value = mfield.get('value', None)
-            else:
-                value = eval('djangoModel.%s' % mfield)
-            if type(value) is datetime.datetime:
-                value = self.__formatDateTime(value)
-            if onlyReturnReqFeilds and jfield not in reqFields:
-                continue
-            jsonDict[jfield] = value
-        return jsonDict
+    def __expandRecords(self, request, entityName, records, expandTree):
+        """
+        Fill expand items of list records, one query for all records if processor of item implements getListByKeys,
+        level by level for nested items
+        """
+        metadataUtil = self.__engine.getMetadataUtil()
+        keysList = [self.__engine.getKeysFromRecord(entityName, record) for record in records]
+        for expandItem, subTree in expandTree.items():
+            expandItemSet = metadataUtil.getExpandFieldSetType(entityName, expandItem)
+            processor = self.__engine.getProcessorByUrlName(expandItemSet)
+            qt = metadataUtil.getEntityTypeOfName(expandItemSet)
+            results = processor.expandByKeys(request, expandItem, keysList, {'queryType': qt}) \
+                if qt == 'list' and keysList else None
+            if results is None:
+                results = [self.__expandItemProcess(request, expandItem, expandItemSet, keys) for keys in keysList]
+            for record, result in zip(records, results):
+                record[expandItem] = result
+            if subTree:
+                processor.__expandNested(request, expandItemSet, results, subTree)
+
+    def __expandNested(self, request, expandItemSet, results, expandTree):
+        # Records of all parents are expanded together, one query per item of next level
+        records = []
+        for result in results:
+            if type(result) is list:
+                records.extend(r for r in result if type(r) is dict)
+            elif type(result) is dict:
+                records.append(result)
+        if records:
+            entityName = self.__engine.getMetadataUtil().getEntityNameOfType(expandItemSet)
+            self.__expandRecords(request, entityName, records, expandTree)
+
+    def expandByKeys(self, request, expandName, keysList, entityInfo):
+        """Expanded lists of all parent keys in keysList, in same order, None if getListByKeys is not implemented"""
+        batch = self.getListByKeys(keysList, expandName)
+        if batch is None:
+            return None
+        queryset, lookups = batch
+        if type(queryset) is not QuerySet:
+            raise InternalException('getListByKeys result must be QuerySet')
+        query = self.getBaseQuery()
+        if query:
+            queryset = queryset.filter(query)
+        queryset = self.applyRelatedHints(queryset)
+        # Parent key values of each row are read with the row and rows grouped by them
+        keyNames = list(lookups)
+        names = ['_parent%d' % i for i in range(len(keyNames))]
+        queryset = queryset.annotate(**{n: F(lookups[k]) for n, k in zip(names, keyNames)})
+        records, parentValues = self.__convertAnnotatedQuerySet(queryset, names)
+        groups = {}
+        for record, values in zip(records, parentValues):
+            group = groups.setdefault(tuple(values), [])
+            if not self.__maxReturnSize or len(group) < self.__maxReturnSize:
+                group.append(record)
+        self.afterGetList(queryset)
+        results = []
+        for keys in keysList:
+            parentKey = next(iter(keys.values()))
+            result = groups.get(tuple(parentKey[k] for k in keyNames), [])
+            result = self.customizedListResponse(result, maxPages=1)
+            results.append(self.postProcessResult(result, entityInfo.get('queryType', None), request.method))
+        return results
 
     def __populateToModel(self, jsonDict, djangoModel, fields, usage):
-        for field in fields:
-            custCall = False
-            if type(field) is tuple:
-                jfield, mfield = field[0], field[1]
-            else:
-                mfield = jfield = field
-            if usage == 'UPDATE':
-                # Ignore key field and non-updatable fields
-                if self.__engine.getMetadataUtil().isKeyField(self.getBindEntityName(), jfield) \
-                        or not self.__engine.getMetadataUtil().isFieldUpdatable(self.getBindEntityName(), jfield):
-                    continue
-            value = jsonDict.get(jfield, None)
-            if value is None:
-                continue
-            if callable(mfield):
-                result = mfield(djangoModel, jsonDict[jfield])
-                if result is None:
-                    continue
-                else:
-                    (mfield, value) = result
-                    custCall = True
-            elif type(mfield) is dict:
-                value = mfield.get('value', None)
-            if value is not None:
-                if custCall:
-                    exec("djangoModel.%s=value" % mfield)
-                else:
-                    fieldType = self.__engine.getMetadataUtil().getProperyFeildDef(self.getBindEntityName(),
-                                                                                   jfield).get(
-                        'type', None)
-                    if fieldType in ['int', 'boolean', 'float']:
-                        exec("djangoModel.%s=%s" % (mfield, value))
-                    else:
-                        exec("djangoModel.%s='%s'" % (mfield, value))
+        self.getModelPopulator(fields, usage).populate(jsonDict, djangoModel)
+
+    def getModelPopulator(self, fields, usage):
+        """Populate model mapping compiled into ModelPopulator, compiled again when mapping or metadata changes"""
+        metadataUtil = self.__engine.getMetadataUtil()
+        populator = self.__modelPopulators.get(usage, None)
+        if populator is None or populator.version != metadataUtil.version or not populator.matches(fields):
+            populator = ModelPopulator(fields, metadataUtil.getEntitySchema(self.getBindEntityName()), usage,
+                                       metadataUtil.version)
+            # Copy on write, processor is shared by threads
+            populators = dict(self.__modelPopulators)
+            populators[usage] = populator
+            self.__modelPopulators = populators
+        return populator
 
     def __validateEntity(self, json, entityInfo):
         """Validate json request entity against metadata definition"""
@@ -825,6 +2148,7 @@ class RESTProcessor(object):
                 result = self.convertData(model, None)
             else:
                 result = self.post(request)
+            transaction.on_commit(self.invalidateCaches)
             self.afterPost(model)
             return result
         except Exception as e:
@@ -850,6 +2174,7 @@ class RESTProcessor(object):
                     result = {}
                 else:
                     result = self.put(request, keys)
+                transaction.on_commit(self.invalidateCaches)
                 self.afterPut(model)
                 return result
         except Exception as e:
@@ -874,6 +2199,7 @@ class RESTProcessor(object):
                     else:
                         model.delete()
                     result = {}
+                transaction.on_commit(self.invalidateCaches)
                 self.afterDelete(model)
                 return result
         except Exception as e:
@@ -887,32 +2213,40 @@ class RESTProcessor(object):
             expandArray = params.get('expand', [])
             query = params.get('query', None)
             entityName = entityInfo.get('entityName', None)
-            self.__validateExpandItem(entityName, expandArray)
+            expandTree = self.__getExpandTree(entityName, expandArray)
             if queryType == 'single':
                 result = self.getSingle(request, keys)
                 # Add expand item
-                for expandItem in expandArray:
+                for expandItem, subTree in expandTree.items():
                     expandItemSet = self.__engine.getMetadataUtil().getExpandFieldSetType(entityName, expandItem)
                     result[expandItem] = self.__expandItemProcess(request, expandItem, expandItemSet, keys)
+                    if subTree:
+                        self.__engine.getProcessorByUrlName(expandItemSet).__expandNested(
+                            request, expandItemSet, [result[expandItem]], subTree)
             elif queryType == 'list':
                 if query:
                     try:
-                        parser = Parser(query)
-                        conditions = parser.toDict(parser.parse())
+                        plan, values = self.__engine.getQueryPlan(query)
+                        conditions = plan.bind(values)
                         params['conditions'] = conditions
+                        if type(self).optimizeConditions is RESTProcessor.optimizeConditions:
+                            # Template is optimized once per plan, only values are bound
+                            conditions = plan.bind(values, optimized=True)
+                        else:
+                            conditions = self.optimizeConditions(conditions)
+                        params['optimizedConditions'] = conditions
                         q = self.parseToQObject(conditions)
                         params['q'] = q
                     except Exception as e:
                         raise ParameterErrorException('Error when parsing query url: %s' % str(e))
+                # Only the requested list itself is streamed, expanded or expand lists are built as a whole,
+                # overwritten list hooks get the rows as list
+                params['streaming'] = not expandArray and 'expandName' not in params and \
+                    type(self).customizedListResponse is RESTProcessor.customizedListResponse and \
+                    type(self).postProcessResult is RESTProcessor.postProcessResult
                 result, listParams = self.getList(request, keys, **params)
-                if type(result) is list and expandArray:
-                    for resultRecord in list(result):
-                        expandKeys = self.__engine.getKeysFromRecord(entityName, resultRecord)
-                        for expandItem in expandArray:
-                            expandItemSet = self.__engine.getMetadataUtil().getExpandFieldSetType(entityName,
-                                                                                                  expandItem)
-                            resultRecord[expandItem] = self.__expandItemProcess(request, expandItem, expandItemSet,
-                                                                                expandKeys)
+                if type(result) is list and expandTree:
+                    self.__expandRecords(request, entityName, result, expandTree)
                 result = self.customizedListResponse(result, **listParams)
         elif request.method == 'HEAD':
             result = self.head(request)
@@ -970,10 +2304,34 @@ class RESTProcessor(object):
     def getListByKey(self, keys, expandName=None):
         return None
 
+    def getListByKeys(self, keysList, expandName=None):
+        """
+        getListByKey for all records of a list with _expand at once, keysList has keys of each parent record.
+        Return QuerySet of rows of all parents and lookup of each parent key in rows, e.g. for users of orgs
+            return User.objects.filter(org__id__in=[k['org']['id'] for k in keysList]), {'id': 'org__id'}
+        None to call getListByKey for each parent record
+        """
+        return None
+
     def customizedListResponse(self, data, **kwargs):
+        if 'next' in kwargs:
+            # Cursor pagination, next is None on last page
+            return {'rows': data, 'next': kwargs['next']}
         return data
 
     def getList(self, request, keys, **kwargs):
+        timeout = self.getResultCacheTTL()
+        # Streamed lists are read while they are sent, not cached
+        streamed = kwargs.get('streaming', False) and not kwargs.get('count', False) and \
+            kwargs.get('cursor', None) is None and not kwargs.get('distinct', None) and self.getStreamingChunkSize()
+        if timeout and not streamed:
+            key = self.getResultCacheKey(request, keys, kwargs)
+            if key is not None:
+                return self.__engine.getResultCache().getOrLoad(
+                    self.getBindEntityName(), key, timeout, lambda: self.__getList(request, keys, **kwargs))
+        return self.__getList(request, keys, **kwargs)
+
+    def __getList(self, request, keys, **kwargs):
         query = self.getBaseQuery()
         if not query:
             query = Q()
@@ -991,11 +2349,12 @@ class RESTProcessor(object):
             # keys are given, must be expand items, filter result by keys
             expandName = kwargs.get('expandName', None)
             djangoresult = self.getListByKey(keys, expandName)
-            if djangoresult and type(djangoresult) is not QuerySet:
+            # Not evaluated here, truth value of a QuerySet reads its rows
+            if djangoresult is not None and not isinstance(djangoresult, QuerySet):
                 raise InternalException('getListByKey result must be QuerySet')
         order = kwargs.get('order', [])
         order = tuple(order)
-        if type(djangoresult) is QuerySet:
+        if djangoresult is not None:
             # Expand items
             djangoresult = djangoresult.filter(query).order_by(*order)
         else:
@@ -1010,29 +2369,60 @@ class RESTProcessor(object):
             columnNames = distinctColumns.split(',')
             djangoresult = djangoresult.values(*tuple(columnNames)).distinct()
         if kwargs.get('count', False):
-            resultCount = djangoresult.count()
+            resultCount, estimated = self.getCount(djangoresult)
             return (resultCount, {})
         page = kwargs.get('page', None)
         pnum = kwargs.get('pnum', None)
         reqFields = kwargs.get('columns', None)
         forReference = kwargs.get('reference', None)
         forReference = forReference is not None
+        if reqFields and not distinctColumns:
+            # Load only model fields of requested columns
+            onlyFields = self.getProjectionFields(djangoresult.model, reqFields, forReference)
+            if onlyFields:
+                djangoresult = djangoresult.only(*onlyFields)
+        if not distinctColumns:
+            djangoresult = self.applyRelatedHints(djangoresult, reqFields, forReference)
+        cursor = kwargs.get('cursor', None)
+        if cursor is not None:
+            # Keyset pagination, page after the row of cursor is sought instead of skipped with offset
+            if distinctColumns:
+                raise ParameterErrorException('Cursor pagination not supported with distinct')
+            pageSize = int(pnum) if pnum else 25
+            if self.__maxReturnSize:
+                pageSize = min(pageSize, self.__maxReturnSize)
+            cursorFields = self.getCursorFields(order)
+            djangoresult = djangoresult.order_by(*['-' + f if descending else f for f, descending in cursorFields])
+            if cursor:
+                djangoresult = djangoresult.filter(self.buildSeekQobject(cursorFields, decodeCursor(cursor, cursorFields)))
+            finalresult, nextCursor = self.getCursorPage(djangoresult, cursorFields, pageSize, reqFields, forReference)
+            self.afterGetList(djangoresult[:pageSize])
+            return (finalresult, {'next': nextCursor})
         # Default pages
         maxPages = 1
+        pagingresult = djangoresult
         # Max result 5000
         if self.__maxReturnSize:
             pagingresult = djangoresult[:self.__maxReturnSize]
+        chunkSize = self.getStreamingChunkSize() if kwargs.get('streaming', False) and not distinctColumns else None
+        count = None
+        windowCount = False
         if page is not None and pnum is not None:
-            resultCount = pagingresult.count()
+            count = self.getCachedCount(djangoresult)
+            # Total comes with rows of page if backend supports window functions, no extra count query
+            windowCount = count is None and self.__countMode == 'window' and not distinctColumns and not chunkSize \
+                and connections[djangoresult.db].features.supports_over_clause
+            if windowCount:
+                pagingresult = djangoresult.annotate(_total=Window(Count('*')))
+                if self.__maxReturnSize:
+                    pagingresult = pagingresult[:self.__maxReturnSize]
+            elif count is None:
+                count = self.getCount(djangoresult)
             p = int(page)
             n = int(pnum)
-            maxPages = math.ceil(resultCount / n)
             sIdx = (p - 1) * n
             eIdx = sIdx + n
             pagingresult = pagingresult[sIdx:eIdx]
-        additionParams = {
-            'maxPages': maxPages
-        }
         if distinctColumns:
             # Wrapper result by distinct column names
             finalresult = []
@@ -1043,19 +2433,193 @@ class RESTProcessor(object):
                 finalresult.append(j)
             fr = (finalresult, {})
         else:
-            # Normal result wrapping
-            finalresult = []
-            for r in pagingresult:
-                record = self.convertData(r, language=None, reqFields=reqFields, forReference=forReference)
-                finalresult.append(record)
-            fr = (finalresult, additionParams)
+            if chunkSize:
+                # Rows are read from database and converted while response is sent
+                rows = self.iterConvertQuerySet(pagingresult, reqFields, forReference, chunkSize)
+                additionParams = self.__getPagingParams(count, pnum)
+                return (RowStream(rows, chunkSize, lambda: self.afterGetList(pagingresult)), additionParams)
+            if windowCount:
+                finalresult, totals = self.__convertAnnotatedQuerySet(pagingresult, ['_total'], reqFields, forReference)
+                # No rows after last page, total is counted then
+                count = (totals[0][0], False) if totals else self.getCount(djangoresult)
+                self.putCachedCount(djangoresult, *count)
+            else:
+                # Normal result wrapping
+                finalresult = list(self.iterConvertQuerySet(pagingresult, reqFields, forReference))
+            fr = (finalresult, self.__getPagingParams(count, pnum))
         self.afterGetList(pagingresult)
         return fr
 
+    def __getPagingParams(self, count, pnum):
+        if count is None:
+            return {'maxPages': 1}
+        resultCount, estimated = count
+        if self.__maxReturnSize:
+            resultCount = min(resultCount, self.__maxReturnSize)
+        maxPages = math.ceil(resultCount / int(pnum))
+        # customizedListResponse of processors without count settings keeps its signature
+        if self.__countMode is None and self.__countCache is None:
+            return {'maxPages': maxPages}
+        return {'maxPages': maxPages, 'count': resultCount, 'countEstimated': estimated}
+
     def afterGetList(self, models):
         pass
 
+    def getCursorFields(self, order):
+        """(field, descending) of _order followed by metadata key fields not in _order, unique order of rows"""
+        fields = [(o[1:], True) if o.startswith('-') else (o, False) for o in order]
+        names = [f for f, descending in fields]
+        for k in self.__engine.getMetadataUtil().getEntitySchema(self.getBindEntityName()).keyNames:
+            k = self.getMappedFieldName(k)
+            if k not in names:
+                fields.append((k, False))
+        return fields
+
+    def buildSeekQobject(self, fields, values):
+        """Rows after values in order of fields, (a > x) or (a = x and b > y) ..., a >= x first for index range"""
+        q = Q()
+        equal = Q()
+        for (field, descending), value in zip(fields, values):
+            q.add(equal & self.buildQobject(field, '<' if descending else '>', value), Q.OR)
+            equal = equal & self.buildQobject(field, '=', value)
+        field, descending = fields[0]
+        return self.buildQobject(field, '<=' if descending else '>=', values[0]) & q
+
+    def getCursorPage(self, queryset, fields, pageSize, reqFields=None, forReference=False):
+        """Records of first pageSize rows of queryset and cursor of last one, None if no more rows"""
+        # Values of cursor fields are read with the rows, so cursor is exactly the last row returned
+        names = ['_cursor%d' % i for i in range(len(fields))]
+        queryset = queryset.annotate(**{n: F(f) for n, (f, descending) in zip(names, fields)})
+        records, seek = self.__convertAnnotatedQuerySet(queryset[:pageSize + 1], names, reqFields, forReference)
+        nextCursor = encodeCursor(fields, seek[pageSize - 1]) if len(seek) > pageSize else None
+        return records[:pageSize], nextCursor
+
+    def __convertAnnotatedQuerySet(self, queryset, names, reqFields=None, forReference=False):
+        """Records of queryset and values of annotations names of each row"""
+        valuesSerializer = self.getValuesSerializer(queryset.model, reqFields, forReference)
+        if valuesSerializer:
+            # Serializer reads its own positions, annotations are appended
+            rows = list(queryset.values_list(*(list(valuesSerializer.lookups) + names)))
+            return (list(valuesSerializer.iterSerialize(rows, self.getDateTimeFormatter())),
+                    [row[-len(names):] for row in rows])
+        models = list(queryset)
+        return (self.convertDataList(models, reqFields=reqFields, forReference=forReference),
+                [[getattr(m, n) for n in names] for m in models])
+
+    def setCountMode(self, mode, estimateThreshold=1000000):
+        """
+        How total of paged lists and _count is got, 'count' query, 'window' COUNT(*) OVER() read with rows
+        of page, 'estimate' row estimate of query planner (postgresql) if at least estimateThreshold
+        """
+        if mode not in ('count', 'window', 'estimate'):
+            raise InternalException('Count mode %s not supported' % mode)
+        self.__countMode = mode
+        self.__countEstimateThreshold = estimateThreshold
+
+    def setCountCacheTTL(self, seconds, maxSize=1024):
+        """Cache totals per filter for seconds, cleared on create, update and delete, None to disable"""
+        self.__countCacheTTL = seconds
+        self.__countCache = LRUCache(maxSize) if seconds else None
+
+    def clearCountCache(self):
+        """Drop cached totals, e.g. after rows are changed outside of processor"""
+        countCache = self.__countCache
+        if countCache is not None:
+            countCache.clear()
+
+    def invalidateCaches(self):
+        """
+        Drop cached results and totals of entity, called after create, update and delete are committed.
+        Results of entities expanding this one are dropped too, e.g. rows of cascaded deletes
+        """
+        self.clearCountCache()
+        entityName = self.getBindEntityName()
+        resultCache = self.__engine.getResultCache()
+        resultCache.invalidate(entityName)
+        for expandingEntityName in self.__engine.getMetadataUtil().getExpandingEntityNames(entityName):
+            if expandingEntityName != entityName:
+                resultCache.invalidate(expandingEntityName)
+
+    def getResultCacheTTL(self):
+        """Seconds results are kept in result cache of engine, cacheTTL of entity in metadata, None not to cache"""
+        schema = self.__engine.getMetadataUtil().getEntitySchema(self.getBindEntityName())
+        return schema.cacheTTL if schema else None
+
+    def getResultCacheKey(self, request, keys, params):
+        """
+        Key of list or single result in result cache, None not to cache it. Results depend on keys and
+        parameters only, overwrite to add e.g. user if getBaseQuery or convertData depends on it
+        """
+        # Optimized conditions are the normalized _query, q only if it is set otherwise, e.g. by customizedQueryParser
+        conditions = params['optimizedConditions'] if 'optimizedConditions' in params else params.get('q', None)
+        values = [keys, conditions] + [params.get(name, None) for name in (
+            'fastquery', 'order', 'page', 'pnum', 'distinct', 'count', 'columns', 'reference', 'cursor',
+            'expandName')]
+        text = json.dumps(values, sort_keys=True, default=str)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def getCountCacheStats(self):
+        countCache = self.__countCache
+        return countCache.stats() if countCache is not None else None
+
+    def __getCountCacheKey(self, queryset):
+        # Compiled sql with parameters is the normalized filter, order does not change total
+        sql, params = queryset.order_by().query.sql_with_params()
+        return sql, tuple(params)
+
+    def getCachedCount(self, queryset):
+        """(count, estimated) of queryset cached within ttl, None if not cached"""
+        countCache = self.__countCache
+        if countCache is None:
+            return None
+        try:
+            cached = countCache.get(self.__getCountCacheKey(queryset))
+        except EmptyResultSet:
+            return (0, False)
+        if cached is None or cached[2] < time.time():
+            return None
+        return cached[0], cached[1]
+
+    def putCachedCount(self, queryset, count, estimated=False):
+        countCache = self.__countCache
+        if countCache is not None:
+            try:
+                countCache.put(self.__getCountCacheKey(queryset), (count, estimated, time.time() + self.__countCacheTTL))
+            except EmptyResultSet:
+                pass
+
+    def getCount(self, queryset):
+        """(count, estimated) of queryset by count mode, from count cache if enabled"""
+        count = self.getCachedCount(queryset)
+        if count is not None:
+            return count
+        count = None
+        if self.__countMode == 'estimate':
+            estimate = self.estimateCount(queryset)
+            if estimate is not None and estimate >= self.__countEstimateThreshold:
+                count = (estimate, True)
+        if count is None:
+            count = (queryset.count(), False)
+        self.putCachedCount(queryset, *count)
+        return count
+
+    def estimateCount(self, queryset):
+        """Rows of queryset estimated by query planner without running it, None if backend has no estimate"""
+        if connections[queryset.db].vendor != 'postgresql':
+            return None
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+
     def getSingle(self, request, keys):
+        timeout = self.getResultCacheTTL()
+        if timeout:
+            key = self.getResultCacheKey(request, keys, {})
+            if key is not None:
+                return self.__engine.getResultCache().getOrLoad(
+                    self.getBindEntityName(), key, timeout, lambda: self.__getSingle(request, keys))
+        return self.__getSingle(request, keys)
+
+    def __getSingle(self, request, keys):
         djangoModel = self.__getDjangoModel()
         if not djangoModel:
             raise InternalException('Model not defined')
@@ -1068,7 +2632,7 @@ class RESTProcessor(object):
         baseQ = self.getBaseQuery()
         if baseQ:
             q.add(baseQ, Q.AND)
-        model = djangoModel.objects.get(q)
+        model = self.applyRelatedHints(djangoModel.objects.all()).get(q)
         record = self.convertData(model, None)
         self.afterGetSingle(model)
         return record
@@ -1145,17 +2709,143 @@ class RESTProcessor(object):
     def getPopulateFieldReferenceMapping(self):
         return None
 
-    def convertData(self, model, language=None, reqFields=None, forReference=False):
+    def getRowSerializer(self, forReference=False):
+        """Populate field mapping compiled into RowSerializer, compiled again only when mapping changes"""
         if forReference:
             mapping = self.getPopulateFieldReferenceMapping()
         else:
             mapping = self.getPopulateFieldMapping()
-        if mapping:
-            record = {}
-            self.__populateToJson(record, model, mapping, reqFields)
-            return record
+        if not mapping:
+            return None
+        serializer = self.__rowSerializers.get(forReference, None)
+        if serializer is None or not serializer.matches(mapping):
+            serializer = RowSerializer(mapping)
+            # Copy on write, processor is shared by threads
+            serializers = dict(self.__rowSerializers)
+            serializers[forReference] = serializer
+            self.__rowSerializers = serializers
+        return serializer
+
+    def getDateTimeFormatter(self):
+        """Function formatting datetime values of records, None to keep them, see setRawDateTime of engine"""
+        engine = self.__engine if self.__engine is not None else ENGINE
+        return engine.getDateTimeFormatter()
+
+    def convertData(self, model, language=None, reqFields=None, forReference=False):
+        serializer = self.getRowSerializer(forReference)
+        if serializer:
+            formatter = getattr(self.__conversion, 'formatter', None)
+            formatDateTime = formatter[0] if formatter is not None else self.getDateTimeFormatter()
+            return serializer.serialize(model, reqFields, formatDateTime)
         return {}
 
+    def convertDataList(self, models, language=None, reqFields=None, forReference=False):
+        return list(self.iterConvertData(models, language, reqFields, forReference))
+
+    def iterConvertData(self, models, language=None, reqFields=None, forReference=False):
+        if type(self).convertData is not RESTProcessor.convertData:
+            # Looked up while request is handled, rows of a streamed list are converted later
+            return self.__iterConvertEach(models, (self.getDateTimeFormatter(),), language, reqFields, forReference)
+        # Mapping is compiled once for all rows
+        serializer = self.getRowSerializer(forReference)
+        if serializer:
+            if reqFields:
+                serializer = serializer.project(reqFields)
+            formatDateTime = self.getDateTimeFormatter()
+            return (serializer.serialize(model, formatDateTime=formatDateTime) for model in models)
+        return ({} for model in models)
+
+    def __iterConvertEach(self, models, formatter, language, reqFields, forReference):
+        """Rows by overwritten convertData, its call of RESTProcessor.convertData uses formatter of the list"""
+        conversion = self.__conversion
+        for model in models:
+            outer = getattr(conversion, 'formatter', None)
+            conversion.formatter = formatter
+            try:
+                record = self.convertData(model, language=language, reqFields=reqFields, forReference=forReference)
+            finally:
+                conversion.formatter = outer
+            yield record
+
+    def setValuesList(self, valuesList):
+        """
+        Read lists with values_list instead of model objects when mapping only has model fields, None(default)
+        to do so unless convertData or afterGetList is overwritten, True to do so even with afterGetList, False never
+        """
+        self.__valuesList = valuesList
+
+    def getValuesSerializer(self, djangoModel, reqFields=None, forReference=False):
+        if self.__valuesList is False or type(self).convertData is not RESTProcessor.convertData:
+            return None
+        if self.__valuesList is None and type(self).afterGetList is not RESTProcessor.afterGetList:
+            # afterGetList gets model objects
+            return None
+        serializer = self.getRowSerializer(forReference)
+        if not serializer:
+            return None
+        if reqFields:
+            serializer = serializer.project(reqFields)
+        return serializer.getValuesSerializer(djangoModel)
+
+    def iterConvertQuerySet(self, queryset, reqFields=None, forReference=False, chunkSize=None):
+        """Records of queryset, read with iterator of chunkSize if given"""
+        valuesSerializer = self.getValuesSerializer(queryset.model, reqFields, forReference)
+        if valuesSerializer:
+            rows = queryset.values_list(*valuesSerializer.lookups)
+            return valuesSerializer.iterSerialize(rows.iterator(chunk_size=chunkSize) if chunkSize else rows,
+                                                  self.getDateTimeFormatter())
+        models = queryset.iterator(chunk_size=chunkSize) if chunkSize else queryset
+        return self.iterConvertData(models, language=None, reqFields=reqFields, forReference=forReference)
+
+    def getSelectRelated(self):
+        """Related objects joined when rows are read as model objects, e.g. for lambda x: x.owner.name"""
+        schema = self.__engine.getMetadataUtil().getEntitySchema(self.getBindEntityName())
+        return list(schema.selectRelated) if schema else []
+
+    def getPrefetchRelated(self):
+        """Related lists prefetched when rows are read as model objects, e.g. for lambda x: x.tags.count()"""
+        schema = self.__engine.getMetadataUtil().getEntitySchema(self.getBindEntityName())
+        return list(schema.prefetchRelated) if schema else []
+
+    def applyRelatedHints(self, queryset, reqFields=None, forReference=False):
+        """
+        select_related and prefetch_related of processor and metadata, together with related objects of
+        dotted fields in mapping, on queryset read as model objects
+        """
+        if self.getValuesSerializer(queryset.model, reqFields, forReference):
+            # values_list reads related fields with joins itself
+            return queryset
+        selectRelated = self.getSelectRelated()
+        serializer = self.getRowSerializer(forReference) \
+            if type(self).convertData is RESTProcessor.convertData else None
+        if serializer:
+            if reqFields:
+                serializer = serializer.project(reqFields)
+            selectRelated += [r for r in serializer.getSelectRelated(queryset.model) if r not in selectRelated]
+        if reqFields and selectRelated:
+            # Related object of a field not loaded by only can't be joined
+            onlyFields = self.getProjectionFields(queryset.model, reqFields, forReference)
+            if onlyFields is not None:
+                selectRelated = [r for r in selectRelated if r.split('__', 1)[0] in onlyFields]
+        if selectRelated:
+            queryset = queryset.select_related(*selectRelated)
+        prefetchRelated = self.getPrefetchRelated()
+        if prefetchRelated:
+            queryset = queryset.prefetch_related(*prefetchRelated)
+        return queryset
+
+    def getProjectionFields(self, djangoModel, reqFields, forReference=False):
+        """
+        Model fields loaded from database for requested _columns, None to load all fields. Mapping with
+        functions loads all, overwrite to return the fields they read or if other code reads more fields
+        """
+        if type(self).convertData is not RESTProcessor.convertData:
+            return None
+        serializer = self.getRowSerializer(forReference)
+        if not serializer:
+            return None
+        return serializer.project(reqFields).getModelFields(djangoModel)
+
     def getPopulateModelMapping(self):
         """
         Array list contains field name, each object can be:
@@ -1178,25 +2868,53 @@ class RESTProcessor(object):
             self.__populateToModel(json, model, mapping, usage)
         return model
 
+    def optimizeConditions(self, conditions):
+        """
+        Rewrite parsed conditions before building Q object, e.g. OR of equals into __in, see Optimizer.
+        Overwrite and return conditions as is to disable
+        """
+        return Optimizer().optimize(conditions)
+
     def parseToQObject(self, conditions):
         opt = conditions.get('opt', None)
         if not opt:
             return None
+        if opt == 'false':
+            # Never matches, django returns empty result without querying database
+            return Q(pk__in=[])
         if not (opt == 'and' or opt == 'or'):
             field = conditions.get('field', None)
             # Chance to get db model field name
             field = self.getMappedFieldName(field)
             value = conditions.get('value', None)
+            if opt == '@' or opt == '!@':
+                if type(value) is str:
+                    # Range given as one value, e.g. age@"18,30"
+                    value = [v.strip() for v in value.split(',')]
+                if type(value) is not list or len(value) != 2:
+                    raise ParameterErrorException('Range %s requires two values, e.g. %s@["1","10"]' % (field, field))
+                return self.buildQobject(field, opt, value[0], value[1])
             return self.buildQobject(field, opt, value)
-        else:
-            left = conditions.get('left', None)
-            right = conditions.get('right', None)
-            qleft = self.parseToQObject(left)
-            qright = self.parseToQObject(right)
-            q2 = Q()
-            q2.add(qleft, opt.upper())
-            q2.add(qright, opt.upper())
-            return q2
+        # Walk with explicit stack, nested and/or of same operator are added into one Q
+        optimizer = Optimizer()
+        results = {}
+        stack = [(conditions, None)]
+        while stack:
+            node, operands = stack.pop()
+            if operands is None:
+                operands = optimizer.operands(node)
+                stack.append((node, operands))
+                for operand in operands:
+                    if optimizer.isNode(operand):
+                        stack.append((operand, None))
+            else:
+                q2 = Q()
+                for operand in operands:
+                    qoperand = results.pop(id(operand)) if id(operand) in results else self.parseToQObject(operand)
+                    if qoperand is not None:
+                        q2.add(qoperand, node['opt'].upper())
+                results[id(node)] = q2
+        return results[id(conditions)]
 
     def buildQobject(self, fieldname, opt, low, high=None):
         q = Q()
@@ -1216,8 +2934,12 @@ class RESTProcessor(object):
             conKey = ''.join([fieldname, '__contains'])
             q.add(~Q(**{conKey: low}), ao)
         elif opt == '=':
+            if type(low) is list:
+                conKey = ''.join([fieldname, '__in'])
             q.add(Q(**{conKey: low}), ao)
         elif opt == '!=':
+            if type(low) is list:
+                conKey = ''.join([fieldname, '__in'])
             q.add(~Q(**{conKey: low}), ao)
         elif opt == '<':
             conKey = ''.join([fieldname, '__lt'])
@@ -1232,14 +2954,12 @@ class RESTProcessor(object):
             conKey = ''.join([fieldname, '__gte'])
             q.add(Q(**{conKey: low}), ao)
         elif opt == '@':
-            rq = Q()
-            conKey = ''.join([fieldname, '__gte'])
-            q1 = Q(**{conKey: low})
-            conKey = ''.join([fieldname, '__lte'])
-            q2 = Q(**{conKey: high})
-            rq.add(q1, Q.AND)
-            rq.add(q2, Q.AND)
-            q.add(rq, Q.AND)
+            # Single BETWEEN predicate
+            conKey = ''.join([fieldname, '__range'])
+            q.add(Q(**{conKey: (low, high)}), ao)
+        elif opt == '!@':
+            conKey = ''.join([fieldname, '__range'])
+            q.add(~Q(**{conKey: (low, high)}), ao)
         return q
 
     def postProcessResult(self, result, queryType, method):
@@ -1280,7 +3000,10 @@ def requireProcess(fLogin=None, fDecrypt=None):
                     except Exception as e:
                         return errorResponse(400, 'Invalid request %s' % str(e))
                 elif 'application/xml' in requestContentTypes:
-                    body = XmlConvert.xml_to_dict(request.body)
+                    try:
+                        body = XmlConvert.iterparse_to_dict(body)
+                    except Exception as e:
+                        return errorResponse(400, 'Invalid request %s' % str(e))
             request.jsonBody = body
             try:
                 return view_func(*args, **kwargs)
@@ -1304,8 +3027,6 @@ def requireProcess(fLogin=None, fDecrypt=None):
 
 ENGINE = RESTEngine()
 
-ENGINE.start()
-
 
 def register(name, model):
     def decorate(processorClass):
@@ -0,0 +1,15 @@
+# -*- coding: UTF-8 -*-
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+def pytest_configure():
+    # Engine imports django, tests only need settings and an in memory database
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(USE_TZ=True, TIME_ZONE='UTC',
+                           DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}})
+        import django
+        django.setup()
@@ -0,0 +1,108 @@
+# -*- coding: UTF-8 -*-
+"""Models, processors and request helpers of engine tests, metadata is api.yaml"""
+import datetime
+import json
+import os
+
+from django.db import connection, models
+from django.test import RequestFactory
+
+from myrest.myrestengine import RESTEngine, RESTProcessor
+
+METADATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api.yaml')
+
+
+def createModel(modelName, **fields):
+    attrs = dict(fields, __module__=__name__, Meta=type('Meta', (), {'app_label': 'tests'}))
+    return type(modelName, (models.Model,), attrs)
+
+
+Org = createModel('Org', name=models.CharField(max_length=50))
+User = createModel('User', name=models.CharField(max_length=50), age=models.IntegerField(default=0),
+                   org=models.ForeignKey(Org, null=True, on_delete=models.CASCADE, related_name='users'),
+                   createdAt=models.DateTimeField(null=True))
+Tag = createModel('Tag', label=models.CharField(max_length=50),
+                  user=models.ForeignKey(User, on_delete=models.CASCADE, related_name='tags'))
+
+with connection.schema_editor() as editor:
+    for model in (Org, User, Tag):
+        editor.create_model(model)
+
+
+def createRows(orgs=3, users=4, tags=2):
+    """orgs with users each, users with tags each, ids start from 1"""
+    for model in (Tag, User, Org):
+        model.objects.all().delete()
+    created = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    for o in range(orgs):
+        org = Org.objects.create(id=o + 1, name='org%d' % o)
+        for u in range(users):
+            user = User.objects.create(id=o * users + u + 1, name='u%d_%d' % (o, u), age=10 * o + u, org=org,
+                                       createdAt=created + datetime.timedelta(minutes=o * users + u))
+            for t in range(tags):
+                Tag.objects.create(label='t%d' % t, user=user)
+
+
+class OrgProcessor(RESTProcessor):
+    def getPopulateFieldMapping(self):
+        return ['id', 'name']
+
+    def getPopulateModelMapping(self):
+        return ['name']
+
+
+class UserProcessor(RESTProcessor):
+    def getPopulateFieldMapping(self):
+        return ['id', 'name', 'age', ('orgId', 'org_id'), 'createdAt']
+
+    def getPopulateModelMapping(self):
+        return ['name', 'age', ('orgId', 'org_id')]
+
+    def getListByKey(self, keys, expandName=None):
+        return User.objects.filter(org__id=keys['org']['id'])
+
+    def getListByKeys(self, keysList, expandName=None):
+        return User.objects.filter(org__id__in=[keys['org']['id'] for keys in keysList]), {'id': 'org__id'}
+
+
+class TagProcessor(RESTProcessor):
+    """Only getListByKey, expanded per parent record"""
+
+    def getPopulateFieldMapping(self):
+        return ['id', 'label', ('userId', 'user_id')]
+
+    def getPopulateModelMapping(self):
+        return ['label', ('userId', 'user_id')]
+
+    def getListByKey(self, keys, expandName=None):
+        return Tag.objects.filter(user__id=keys['user']['id'])
+
+
+def createEngine(org=None, user=None, tag=None):
+    """Engine with own processors, given processors replace the default ones"""
+    engine = RESTEngine()
+    engine.setMetadataCacheDir('')
+    engine.setValCSRFToken(False)
+    engine.start([METADATA])
+    engine.registerProcessor('org', org or OrgProcessor(Org))
+    engine.registerProcessor('user', user or UserProcessor(User))
+    engine.registerProcessor('tag', tag or TagProcessor(Tag))
+    return engine
+
+
+def call(engine, method, path, data=None, **extra):
+    factory = RequestFactory()
+    if method == 'GET':
+        request = factory.get('/', data or {}, **extra)
+    else:
+        body = json.dumps(data) if data is not None else ''
+        request = getattr(factory, method.lower())('/', body, content_type='application/json', **extra)
+        request.jsonBody = data
+    request.session = {}
+    return engine.handle(request, path)
+
+
+def content(response):
+    if response.streaming:
+        return b''.join(response.streaming_content)
+    return response.content
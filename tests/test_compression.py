@@ -0,0 +1,62 @@
+# -*- coding: UTF-8 -*-
+import gzip
+import unittest
+import zlib
+
+from restapp import User, UserProcessor, call, content, createEngine, createRows
+
+
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        createRows()
+        self.engine = createEngine()
+        self.plain = content(call(self.engine, 'GET', 'users'))
+
+    def get(self, path='users', encoding='gzip', **extra):
+        return call(self.engine, 'GET', path, HTTP_ACCEPT_ENCODING=encoding, **extra)
+
+    def testOffByDefault(self):
+        response = self.get()
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, self.plain)
+        self.assertFalse(self.get('_metadata').has_header('Content-Encoding'))
+
+    def testCompressedByAcceptEncoding(self):
+        self.engine.setCompression(True, 6, {'*': 100})
+        response = self.get()
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), self.plain)
+        response = self.get(encoding='gzip;q=0.5, deflate')
+        self.assertEqual(response['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(response.content), self.plain)
+        self.assertFalse(self.get(encoding='gzip;q=0, br').has_header('Content-Encoding'))
+
+    def testMinSize(self):
+        self.engine.setCompression(True, 6, {'*': len(self.plain) + 1})
+        self.assertFalse(self.get().has_header('Content-Encoding'))
+        self.engine.setCompression(True, 6, {'application/json': len(self.plain)})
+        self.assertEqual(self.get()['Content-Encoding'], 'gzip')
+        self.engine.setCompression(True, 6, {'application/json': None})
+        self.assertFalse(self.get().has_header('Content-Encoding'))
+
+    def testStreamedListIsCompressed(self):
+        processor = UserProcessor(User)
+        processor.setStreaming(5)
+        self.engine = createEngine(user=processor)
+        self.engine.setCompression(True)
+        response = self.get()
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(content(response)), self.plain)
+
+    def testMetadataFollowsSettings(self):
+        plain = self.get('_metadata')
+        self.engine.setCompression(True, 1, {'*': 100})
+        response = self.get('_metadata')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['ETag'], '"%s-gzip"' % plain['ETag'][1:-1])
+        self.assertEqual(self.get('_metadata', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.engine.setCompression(True, 9)
+        self.assertEqual(gzip.decompress(self.get('_metadata').content), plain.content)
@@ -0,0 +1,67 @@
+# -*- coding: UTF-8 -*-
+import json
+import unittest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from restapp import User, UserProcessor, call, content, createEngine, createRows
+
+
+class CountingProcessor(UserProcessor):
+    def customizedListResponse(self, data, **kwargs):
+        return {'rows': data, 'kwargs': kwargs}
+
+
+class CountTest(unittest.TestCase):
+    def setUp(self):
+        createRows()
+
+    def getPage(self, processor, page, pnum=5):
+        engine = createEngine(user=processor)
+        with CaptureQueriesContext(connection) as queries:
+            response = call(engine, 'GET', 'users', {'_page': page, '_pnum': pnum, '_order': 'id'})
+        self.assertEqual(response.status_code, 200, response.content)
+        return json.loads(content(response)), len(queries)
+
+    def testFixedSignatureOfListResponseIsKept(self):
+        class Processor(UserProcessor):
+            def customizedListResponse(self, data, maxPages=None):
+                return {'rows': data, 'maxPages': maxPages}
+
+        result, queries = self.getPage(Processor(User), 1)
+        self.assertEqual((len(result['rows']), result['maxPages']), (5, 3))
+        result, queries = self.getPage(CountingProcessor(User), 1)
+        self.assertEqual(result['kwargs'], {'maxPages': 3})
+
+    def testCountMode(self):
+        processor = CountingProcessor(User)
+        processor.setCountMode('count')
+        result, queries = self.getPage(processor, 2)
+        self.assertEqual(result['kwargs'], {'maxPages': 3, 'count': 12, 'countEstimated': False})
+        self.assertEqual(queries, 2)
+
+    def testWindowCountIsReadWithRows(self):
+        processor = CountingProcessor(User)
+        processor.setCountMode('window')
+        result, queries = self.getPage(processor, 3)
+        self.assertEqual([row['id'] for row in result['rows']], [11, 12])
+        self.assertEqual(result['kwargs'], {'maxPages': 3, 'count': 12, 'countEstimated': False})
+        self.assertEqual(queries, 1)
+        # No rows after last page, total is counted
+        result, queries = self.getPage(processor, 4)
+        self.assertEqual((result['rows'], result['kwargs']['count']), ([], 12))
+
+    def testCountIsCachedUntilChanged(self):
+        processor = CountingProcessor(User)
+        processor.setCountCacheTTL(30)
+        result, queries = self.getPage(processor, 1)
+        self.assertEqual((result['kwargs']['count'], queries), (12, 2))
+        # Same filter, other page
+        result, queries = self.getPage(processor, 2)
+        self.assertEqual((result['kwargs']['count'], queries), (12, 1))
+        engine = createEngine(user=processor)
+        response = call(engine, 'POST', 'users', {'name': 'new', 'age': 1, 'orgId': 1})
+        self.assertIn(response.status_code, (200, 201), response.content)
+        result, queries = self.getPage(processor, 1)
+        self.assertEqual((result['kwargs']['count'], queries), (13, 2))
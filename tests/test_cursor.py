@@ -0,0 +1,56 @@
+# -*- coding: UTF-8 -*-
+import json
+import unittest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from myrest.myrestengine import decodeCursor, encodeCursor
+from restapp import call, content, createEngine, createRows
+
+
+class CursorTest(unittest.TestCase):
+    def setUp(self):
+        createRows()
+        self.engine = createEngine()
+
+    def get(self, **params):
+        response = call(self.engine, 'GET', 'users', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return json.loads(content(response))
+
+    def pages(self, order, pnum):
+        pages = []
+        cursor = ''
+        while cursor is not None:
+            page = self.get(_cursor=cursor, _pnum=pnum, _order=order, _columns='id,age')
+            pages.append(page['rows'])
+            cursor = page['next']
+        return pages
+
+    def testPagesRoundTrip(self):
+        for order in ('id', '-age', '-name'):
+            pages = self.pages(order, 5)
+            self.assertEqual([len(page) for page in pages], [5, 5, 2], order)
+            rows = [row for page in pages for row in page]
+            self.assertEqual(rows, self.get(_order=order, _columns='id,age'), order)
+
+    def testLastPageHasNoNext(self):
+        self.assertEqual([len(page) for page in self.pages('id', 4)], [4, 4, 4])
+        self.assertIsNone(self.get(_cursor='', _pnum=20)['next'])
+
+    def testOneQueryPerPage(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get(_cursor='', _pnum=5)
+        self.assertEqual(len(queries), 1)
+
+    def testCursorValues(self):
+        fields = [('age', True), ('id', False)]
+        self.assertEqual(decodeCursor(encodeCursor(fields, [18, 120]), fields), [18, 120])
+
+    def testInvalidCursorIsRejected(self):
+        cursor = self.get(_cursor='', _pnum=5, _order='age')['next']
+        for params in ({'_cursor': 'not a cursor'}, {'_cursor': cursor, '_order': '-age'},
+                       {'_cursor': cursor, '_order': 'age', '_format': 'csv'}):
+            response = call(self.engine, 'GET', 'users', params)
+            self.assertEqual(response.status_code, 400, params)
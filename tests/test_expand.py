@@ -0,0 +1,57 @@
+# -*- coding: UTF-8 -*-
+import json
+import unittest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from restapp import User, UserProcessor, call, content, createEngine, createRows
+
+
+class PerRecordUserProcessor(UserProcessor):
+    """Users of each org read by getListByKey"""
+
+    def getListByKeys(self, keysList, expandName=None):
+        return None
+
+
+class ExpandTest(unittest.TestCase):
+    def setUp(self):
+        createRows()
+
+    def get(self, path, params, user=None):
+        engine = createEngine(user=user)
+        with CaptureQueriesContext(connection) as queries:
+            response = call(engine, 'GET', path, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return json.loads(content(response)), [query['sql'] for query in queries]
+
+    def countQueries(self, queries, table):
+        return len([sql for sql in queries if 'FROM "tests_%s"' % table in sql])
+
+    def testExpandOfListIsOneQuery(self):
+        result, queries = self.get('orgs', {'_expand': 'users', '_order': 'id'})
+        self.assertEqual([[user['id'] for user in org['users']] for org in result],
+                         [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10, 11, 12]])
+        self.assertEqual(len(queries), 2)
+        perRecord, perRecordQueries = self.get('orgs', {'_expand': 'users', '_order': 'id'},
+                                               PerRecordUserProcessor(User))
+        self.assertEqual(result, perRecord)
+        self.assertEqual(self.countQueries(perRecordQueries, 'user'), 3)
+
+    def testNestedExpandIsBatchedPerLevel(self):
+        result, queries = self.get('orgs', {'_expand': 'users/tags', '_order': 'id'})
+        self.assertEqual([len(user['tags']) for org in result for user in org['users']], [2] * 12)
+        # Tags have getListByKey only, one query per user
+        self.assertEqual([self.countQueries(queries, table) for table in ('org', 'user', 'tag')], [1, 1, 12])
+        self.assertEqual(len(queries), 14)
+        perRecord, perRecordQueries = self.get('orgs', {'_expand': 'users/tags', '_order': 'id'},
+                                               PerRecordUserProcessor(User))
+        self.assertEqual(result, perRecord)
+        self.assertEqual(len(perRecordQueries), 16)
+
+    def testExpandOfSingle(self):
+        result, queries = self.get('orgs(2)', {'_expand': 'users/tags'})
+        self.assertEqual([user['id'] for user in result['users']], [5, 6, 7, 8])
+        self.assertEqual([len(user['tags']) for user in result['users']], [2] * 4)
+        self.assertEqual([self.countQueries(queries, table) for table in ('org', 'user', 'tag')], [1, 1, 4])
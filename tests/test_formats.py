@@ -0,0 +1,59 @@
+# -*- coding: UTF-8 -*-
+import csv
+import io
+import json
+import unittest
+
+from restapp import User, UserProcessor, call, content, createEngine, createRows
+
+
+class BulkFormatTest(unittest.TestCase):
+    def setUp(self):
+        createRows()
+        self.engine = createEngine()
+        self.params = {'_columns': 'id,name,age', '_order': 'id'}
+
+    def get(self, extra=None, **params):
+        response = call(self.engine, 'GET', 'users', dict(self.params, **params), **(extra or {}))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def expected(self):
+        return json.loads(content(self.get()))
+
+    def testColumnar(self):
+        response = self.get(_format='columnar')
+        self.assertEqual(response['Content-Type'], 'application/vnd.myrest.columnar+json')
+        result = json.loads(content(response))
+        self.assertEqual(result['columns'], ['id', 'name', 'age'])
+        self.assertEqual([dict(zip(result['columns'], row)) for row in result['rows']], self.expected())
+
+    def testNdjson(self):
+        response = self.get({'HTTP_ACCEPT': 'application/x-ndjson'})
+        lines = content(response).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.expected())
+
+    def testCsv(self):
+        response = self.get(_format='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(content(response).decode('utf-8'))))
+        self.assertEqual(rows[0], ['id', 'name', 'age'])
+        self.assertEqual(rows[1:], [[str(r['id']), r['name'], str(r['age'])] for r in self.expected()])
+
+    def testEmptyList(self):
+        self.assertEqual(content(self.get(_format='csv', _query="name='none'")), b'')
+        self.assertEqual(json.loads(content(self.get(_format='columnar', _query="name='none'"))),
+                         {'columns': [], 'rows': []})
+
+    def testStreamedSameAsBuilt(self):
+        built = content(self.get(_format='csv'))
+        processor = UserProcessor(User)
+        processor.setStreaming(5)
+        self.engine = createEngine(user=processor)
+        response = self.get(_format='csv')
+        self.assertTrue(response.streaming)
+        self.assertEqual(content(response), built)
+
+    def testUnknownFormatIsRejected(self):
+        response = call(self.engine, 'GET', 'users', {'_format': 'yaml'})
+        self.assertEqual(response.status_code, 400)
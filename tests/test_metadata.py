@@ -0,0 +1,53 @@
+# -*- coding: UTF-8 -*-
+import unittest
+
+from myrest.myrestengine import MetadataUtil
+
+
+def createMetadata():
+    return {
+        'sets': {'users': 'User'},
+        'User': {
+            'key': [{'name': 'id', 'type': 'int'}],
+            'property': [{'name': 'name', 'type': 'string', 'nullable': False, 'enum': ['a', 'b']}],
+            'expand': [{'name': 'org', 'type': 'orgs'}]
+        }
+    }
+
+
+class EntitySchemaTest(unittest.TestCase):
+    def setUp(self):
+        self.metadata = createMetadata()
+        self.metadataUtil = MetadataUtil(self.metadata)
+        self.schema = self.metadataUtil.getEntitySchema('User')
+
+    def testAttributesCantBeSet(self):
+        with self.assertRaises(AttributeError):
+            self.schema.keys = ()
+
+    def testFieldDefinitionsCantBeChanged(self):
+        with self.assertRaises(TypeError):
+            self.schema.keyMap['id']['type'] = 'string'
+        with self.assertRaises(TypeError):
+            self.schema.properties[0]['nullable'] = True
+        with self.assertRaises(TypeError):
+            self.schema.definition['key'][0]['name'] = 'key'
+        with self.assertRaises(AttributeError):
+            self.schema.fieldMap['name']['enum'].append('c')
+
+    def testChangesOfMetadataDontReachSchema(self):
+        self.metadata['User']['key'][0]['type'] = 'string'
+        self.metadata['User']['property'].append({'name': 'age', 'type': 'int'})
+        self.assertEqual(self.schema.fieldTypes['id'], 'int')
+        self.assertEqual(self.schema.keyMap['id']['type'], 'int')
+        self.assertEqual(self.schema.definition['key'][0]['type'], 'int')
+        self.assertNotIn('age', self.schema.propertyMap)
+
+    def testGettersReturnCopies(self):
+        self.metadataUtil.getKeyFieldDef('User', 'id')['type'] = 'string'
+        self.metadataUtil.getKeyFieldDef('User').append({'name': 'other'})
+        self.metadataUtil.getProperyFeildDef('User', 'name')['enum'].append('c')
+        self.metadataUtil.getFieldDef('User', 'name')['nullable'] = True
+        self.assertEqual(self.metadataUtil.getKeyFieldDef('User'), [{'name': 'id', 'type': 'int'}])
+        self.assertEqual(self.metadataUtil.getProperyFeildDef('User'), createMetadata()['User']['property'])
+        self.assertEqual(self.metadataUtil.getMandatoryFields('User'), ['name'])
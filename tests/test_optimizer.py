@@ -0,0 +1,77 @@
+# -*- coding: UTF-8 -*-
+import unittest
+
+from myrest.myparser import Parser, Optimizer
+
+
+def optimize(text):
+    parser = Parser(text)
+    return Optimizer().optimize(parser.toDict(parser.parse()))
+
+
+class ContradictionTest(unittest.TestCase):
+    def testIdenticalValueIsContradiction(self):
+        self.assertEqual(optimize("name='x',name!='x'"), {'opt': 'false'})
+        self.assertEqual(optimize("(name='a'|name='b'),name!='a',name!='b'"), {'opt': 'false'})
+
+    def testCaseDiffersIsNotContradiction(self):
+        self.assertNotEqual(optimize("name='A',name!='a'"), {'opt': 'false'})
+        self.assertNotEqual(optimize("name='u0_1',name!='U0_1'"), {'opt': 'false'})
+
+    def testNumberTextDiffersIsNotContradiction(self):
+        self.assertNotEqual(optimize("id='1',id!='01'"), {'opt': 'false'})
+
+    def testTrailingBlankIsNotContradiction(self):
+        self.assertNotEqual(optimize("name='x ',name!='x'"), {'opt': 'false'})
+
+    def testDifferentEqualsIsNotContradiction(self):
+        # Both match rows under a case insensitive collation
+        self.assertNotEqual(optimize("name='A',name='a'"), {'opt': 'false'})
+        self.assertNotEqual(optimize("(name='a'|name='b'),name!='a'"), {'opt': 'false'})
+
+    def testReversedRangeIsKept(self):
+        # Compared as text '30' <= '4' holds, range of a text field is not empty
+        self.assertEqual(optimize('age@["30","4"]'), {'opt': '@', 'field': 'age', 'value': ['30', '4']})
+
+
+class ContradictionQueryTest(unittest.TestCase):
+    """Optimized conditions return the same rows as the query as written"""
+
+    @classmethod
+    def setUpClass(cls):
+        from django.db import connection, models
+        attrs = {'name': models.CharField(max_length=20), '__module__': __name__,
+                 'Meta': type('Meta', (), {'app_label': 'tests'})}
+        cls.model = type('OptimizedRow', (models.Model,), attrs)
+        with connection.schema_editor() as editor:
+            editor.create_model(cls.model)
+        cls.model.objects.bulk_create([cls.model(name=name) for name in ('u0_1', 'U0_1', 'x ', 'x')])
+
+    @classmethod
+    def tearDownClass(cls):
+        from django.db import connection
+        with connection.schema_editor() as editor:
+            editor.delete_model(cls.model)
+
+    def query(self, conditions):
+        from myrest.myrestengine import RESTProcessor
+        processor = RESTProcessor(self.model)
+        q = processor.parseToQObject(conditions)
+        return sorted(self.model.objects.filter(q).values_list('name', flat=True))
+
+    def testSameRowsAsWritten(self):
+        for text in ("name='u0_1',name!='U0_1'", "name='x ',name!='x'", "name='x',name!='x'"):
+            parser = Parser(text)
+            conditions = parser.toDict(parser.parse())
+            self.assertEqual(self.query(optimize(text)), self.query(conditions), text)
+        self.assertEqual(self.query(optimize("name='u0_1',name!='U0_1'")), ['u0_1'])
+
+    def testSameRowsFromOptimizedPlan(self):
+        from myrest.myparser import QueryPlanCache
+        cache = QueryPlanCache()
+        for text in ("name='u0_1',name!='U0_1'", "name='x',name!='x'", "name='x'|name='x '|name=['u0_1']",
+                     "name>='u',name<='x'"):
+            plan, values = cache.getPlan(text)
+            parser = Parser(text)
+            conditions = parser.toDict(parser.parse())
+            self.assertEqual(self.query(plan.bind(values, True)), self.query(conditions), text)
@@ -0,0 +1,56 @@
+# -*- coding: UTF-8 -*-
+import unittest
+
+from myrest.myparser import Parser, QueryPlanCache
+
+
+def parse(text):
+    parser = Parser(text)
+    return parser.toDict(parser.parse())
+
+
+class QueryPlanCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = QueryPlanCache()
+
+    def bind(self, text, optimized=False):
+        plan, values = self.cache.getPlan(text)
+        return plan.bind(values, optimized)
+
+    def testSameTextIsNotTokenizedAgain(self):
+        self.bind("name='a'")
+        self.bind("name='a'")
+        self.bind("name='b'")
+        stats = self.cache.stats()
+        self.assertEqual((stats['textHits'], stats['textMisses']), (1, 2))
+        # Both texts share one plan
+        self.assertEqual((stats['size'], stats['hits']), (1, 1))
+
+    def testBindIsSameAsParse(self):
+        for text in ("name='a'", "(name='a'|age>'3'),id=['1','2']", "age@['1','5']|name!=''"):
+            self.assertEqual(self.bind(text), parse(text), text)
+
+    def testOptimizedTemplateIsBound(self):
+        self.assertEqual(self.bind("name='a'|name='b'", True), {'opt': '=', 'field': 'name', 'value': ['a', 'b']})
+        self.assertEqual(self.bind("name=['a','b']|name='c'", True),
+                         {'opt': '=', 'field': 'name', 'value': ['a', 'b', 'c']})
+        self.assertEqual(self.bind("age>='1',age<='5'", True), {'opt': '@', 'field': 'age', 'value': ['1', '5']})
+        self.assertEqual(self.bind("age>='2',age<='7'", True), {'opt': '@', 'field': 'age', 'value': ['2', '7']})
+        self.assertEqual(self.bind("(a='1'|b='2'),(c='3',d='4')", True),
+                         {'opt': 'and', 'items': [
+                             {'opt': 'or', 'items': [{'opt': '=', 'field': 'a', 'value': '1'},
+                                                     {'opt': '=', 'field': 'b', 'value': '2'}]},
+                             {'opt': '=', 'field': 'c', 'value': '3'},
+                             {'opt': '=', 'field': 'd', 'value': '4'}]})
+
+    def testOptimizedTemplateKeepsValuesApart(self):
+        # Literals are different parameters, equal values don't change the rewrite of a shared plan
+        self.assertEqual(self.bind("name='x',name!='y'", True)['opt'], 'and')
+        self.assertEqual(self.bind("name='x',name!='x'", True)['opt'], 'and')
+        plan, values = self.cache.getPlan("name='x'|name='x'")
+        self.assertEqual(plan.bind(values, True), {'opt': '=', 'field': 'name', 'value': ['x', 'x']})
+
+    def testBoundListIsCopied(self):
+        plan, values = self.cache.getPlan("id=['1','2']")
+        plan.bind(values)['value'].append('3')
+        self.assertEqual(plan.bind(values)['value'], ['1', '2'])
@@ -0,0 +1,70 @@
+# -*- coding: UTF-8 -*-
+import json
+import unittest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from myrest.mycache import ResultCache
+from restapp import Org, OrgProcessor, User, UserProcessor, call, content, createEngine, createRows
+
+
+class CachedOrgProcessor(OrgProcessor):
+    def getResultCacheTTL(self):
+        return 30
+
+
+class CachedUserProcessor(UserProcessor):
+    def getResultCacheTTL(self):
+        return 30
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        createRows()
+        self.engine = createEngine(org=CachedOrgProcessor(Org), user=CachedUserProcessor(User))
+
+    def get(self, path, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = call(self.engine, 'GET', path, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return json.loads(content(response)), len(queries)
+
+    def testCachedResultIsReadWithoutQueries(self):
+        result, queries = self.get('users', {'_query': "age>'5'", '_order': 'id'})
+        self.assertEqual(queries, 1)
+        self.assertEqual(self.get('users', {'_query': "age>'5'", '_order': 'id'}), (result, 0))
+        single, queries = self.get('users(3)')
+        self.assertEqual((single['id'], queries), (3, 1))
+        self.assertEqual(self.get('users(3)'), (single, 0))
+
+    def testKeyIsNormalizedQuery(self):
+        result, queries = self.get('users', {'_query': "name='u0_1'|name='u1_1'", '_order': 'id'})
+        self.assertEqual([user['id'] for user in result], [2, 6])
+        # Optimized to the same condition
+        self.assertEqual(self.get('users', {'_query': "name=['u0_1','u1_1']", '_order': 'id'}), (result, 0))
+        self.assertEqual(self.get('users', {'_query': "name='u0_1'", '_order': 'id'})[1], 1)
+
+    def testResultIsDroppedAfterChange(self):
+        self.get('users', {'_order': 'id'})
+        response = call(self.engine, 'PUT', 'users(1)', {'name': 'changed'})
+        self.assertEqual(response.status_code, 204, response.content)
+        result, queries = self.get('users', {'_order': 'id'})
+        self.assertEqual((result[0]['name'], queries), ('changed', 1))
+
+    def testResultOfExpandingEntityIsDropped(self):
+        result, queries = self.get('orgs', {'_expand': 'users', '_order': 'id'})
+        self.assertEqual(self.get('orgs', {'_order': 'id'})[1], 0)
+        response = call(self.engine, 'PUT', 'users(1)', {'name': 'changed'})
+        self.assertEqual(response.status_code, 204, response.content)
+        # Orgs expand users, their results are dropped with users
+        result, queries = self.get('orgs', {'_expand': 'users', '_order': 'id'})
+        self.assertEqual(result[0]['users'][0]['name'], 'changed')
+        self.assertEqual(queries, 2)
+
+    def testBaseCacheKeepsNothing(self):
+        cache = ResultCache()
+        cache.invalidate('user')
+        self.assertEqual([cache.getOrLoad('user', 'k', 30, lambda: [1]) for i in range(2)], [[1], [1]])
+        self.engine.setResultCache(cache)
+        self.assertEqual([self.get('users')[1] for i in range(2)], [1, 1])
@@ -0,0 +1,75 @@
+# -*- coding: UTF-8 -*-
+import datetime
+import unittest
+
+from myrest.myrestengine import RESTEngine, RESTProcessor
+
+
+class Row(object):
+    def __init__(self):
+        self.name = 'a'
+        self.createdAt = datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+
+
+class RowProcessor(RESTProcessor):
+    def getPopulateFieldMapping(self):
+        return ['name', 'createdAt', ('created', lambda m: m.createdAt)]
+
+
+class DateTimeFormatTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = RESTEngine()
+        self.processor = RowProcessor(None)
+        self.processor.setEngine(self.engine)
+
+    def testDateTimeIsFormattedInRecords(self):
+        record = self.processor.convertData(Row())
+        self.assertEqual(record, {'name': 'a', 'createdAt': '2020-01-02 03:04:05', 'created': '2020-01-02 03:04:05'})
+        self.assertEqual(self.processor.convertDataList([Row()], reqFields=['created']),
+                         [{'created': '2020-01-02 03:04:05'}])
+
+    def testDateTimeFormatOfEngine(self):
+        self.engine.setJsonEncoder(self.engine.getJsonEncoder().__class__('iso'))
+        self.assertEqual(self.processor.convertData(Row())['createdAt'], '2020-01-02T03:04:05+00:00')
+
+    def testRawDateTimeIsKept(self):
+        self.engine.setRawDateTime(True)
+        record = self.processor.convertData(Row())
+        self.assertIs(type(record['createdAt']), datetime.datetime)
+        self.assertEqual(self.engine.getJsonEncoder().encode(record),
+                         self.engine.getJsonEncoder().encode({'name': 'a', 'createdAt': '2020-01-02 03:04:05',
+                                                              'created': '2020-01-02 03:04:05'}))
+
+    def testFormatterIsLookedUpOncePerList(self):
+        class Processor(RowProcessor):
+            def convertData(self, model, language=None, reqFields=None, forReference=False):
+                record = RowProcessor.convertData(self, model, language, reqFields, forReference)
+                record['extra'] = 1
+                return record
+
+        lookups = []
+        getDateTimeFormatter = self.engine.getDateTimeFormatter
+
+        def countLookups():
+            lookups.append(1)
+            return getDateTimeFormatter()
+
+        self.engine.getDateTimeFormatter = countLookups
+        processor = Processor(None)
+        processor.setEngine(self.engine)
+        records = processor.convertDataList([Row() for i in range(5)])
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(records[0], {'name': 'a', 'createdAt': '2020-01-02 03:04:05',
+                                      'created': '2020-01-02 03:04:05', 'extra': 1})
+        processor.convertData(Row())
+        self.assertEqual(len(lookups), 2)
+
+
+class JsonEncoderTest(unittest.TestCase):
+    def testDefaultEncoderWritesSameBytesAsJsonModule(self):
+        import json
+        from myrest.myrestengine import JsonEncoder
+        encoder = RESTEngine().getJsonEncoder()
+        self.assertIs(type(encoder), JsonEncoder)
+        value = [{'name': 'é', 'items': [1, 2.5, None], 'ok': True}]
+        self.assertEqual(encoder.encode(value), json.dumps(value).encode('utf-8'))
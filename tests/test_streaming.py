@@ -0,0 +1,59 @@
+# -*- coding: UTF-8 -*-
+import json
+import unittest
+
+from restapp import User, UserProcessor, call, content, createEngine, createRows
+
+
+class StreamingTest(unittest.TestCase):
+    def setUp(self):
+        createRows()
+
+    def createEngine(self, processorClass=UserProcessor):
+        processor = processorClass(User)
+        processor.setStreaming(5)
+        return createEngine(user=processor), processor
+
+    def testStreamedListIsSameAsBuilt(self):
+        engine, processor = self.createEngine()
+        streamed = call(engine, 'GET', 'users', {'_order': '-age'})
+        self.assertTrue(streamed.streaming)
+        processor.setStreaming(0)
+        built = call(engine, 'GET', 'users', {'_order': '-age'})
+        self.assertFalse(built.streaming)
+        streamedContent = content(streamed)
+        self.assertEqual(streamedContent, content(built))
+        self.assertEqual(len(json.loads(streamedContent)), 12)
+
+    def testAfterGetListIsCalledWhenSent(self):
+        calls = []
+
+        class Processor(UserProcessor):
+            def afterGetList(self, models):
+                calls.append(len(models))
+
+        engine, processor = self.createEngine(Processor)
+        response = call(engine, 'GET', 'users')
+        self.assertEqual(calls, [])
+        content(response)
+        self.assertEqual(calls, [12])
+
+    def testOverwrittenHooksGetList(self):
+        class Processor(UserProcessor):
+            def customizedListResponse(self, data, **kwargs):
+                return {'total': len(data), 'first': data[0]['name']}
+
+        engine, processor = self.createEngine(Processor)
+        response = call(engine, 'GET', 'users')
+        self.assertFalse(response.streaming)
+        self.assertEqual(json.loads(content(response)), {'total': 12, 'first': 'u0_0'})
+
+        class Processor(UserProcessor):
+            def postProcessResult(self, result, queryType, method):
+                result.append({'name': 'extra'})
+                return result
+
+        engine, processor = self.createEngine(Processor)
+        response = call(engine, 'GET', 'users')
+        self.assertFalse(response.streaming)
+        self.assertEqual(json.loads(content(response))[-1], {'name': 'extra'})